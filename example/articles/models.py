@@ -15,9 +15,15 @@ class ArticleComment(BaseComment):
     target = models.ForeignKey(Article)
 
 
+class ArchivedArticleComment(BaseComment):
+    target = models.ForeignKey(Article, related_name='archived_comments')
+
+
 class ArticleCommentConfig(comments.CommentConfiguration):
     use_control_question = True
     allow_comments_field_name = 'allow_comments'
     autoclose_after = 25
     autoclose_after_field_name = 'pub_date'
     user_comments = True
+    archive_model = ArchivedArticleComment
+    archive_after = 365
@@ -20,6 +20,12 @@ u'x@x.com'
 >>> c2.author_name
 u'first last'
 
+# The first comment still carries the old name until it's synchronized.
+>>> ArticleCommentConfig('sync', ArticleComment).sync_user_fields(user)
+1
+>>> ArticleComment.objects.get(pk=c1.pk).author_name
+u'first last'
+
 # config tests
 
 >>> b = ArticleCommentConfig('test', ArticleComment)
@@ -54,20 +60,392 @@ False
 >>> comments.get_configuration('article').__class__
 <class 'example.articles.models.ArticleCommentConfig'>
 
+# The comments so far were indexed per user under 'articles', which is now
+# preceded by 'article', so the index is rebuilt.
+>>> call_command('rebuild_comment_activity', verbosity=0)
+>>> UserCommentActivity.objects.values_list('configuration_key', flat=True)
+[u'article', u'article']
+
+# Configurations listed in settings are loaded when first asked for.
+>>> comments.get_configuration('articles').__class__
+<class 'example.articles.models.ArticleCommentConfig'>
+
+# Settings entries can name a comment model by any module it is imported in.
+>>> configurations = settings.SIMPLE_COMMENTS_CONFIGURATIONS
+>>> settings.SIMPLE_COMMENTS_CONFIGURATIONS = dict(configurations,
+...     reexported=('example.articles.tests.ArticleComment',
+...                 'example.articles.models.ArticleCommentConfig'))
+>>> sorted(comments.configurations.get_settings_keys(ArticleComment))
+['articles', 'reexported']
+>>> settings.SIMPLE_COMMENTS_CONFIGURATIONS = configurations
+
+# Near duplicate detection finds slightly altered bodies, but not unrelated
+# ones.
+>>> index = MinHashIndex(max_entries=2)
+>>> index.add(u'Buy cheap watches and bags at our fantastic online '
+...           u'store with free shipping all over the world', 'a')
+>>> index.query(u'Buy cheap watches and bags at our fantastic '
+...             u'online store with free shipping all over the globe', 0.5)[1]
+'a'
+>>> index.query(u'I really enjoyed reading this article, thanks.', 0.5) is None
+True
+
+# Short comments are too common to be treated as spam.
+>>> index.add(u'Thanks!', 'b')
+>>> index.query(u'thanks', 0.8) is None
+True
+
+# The index never grows beyond its bounds.
+>>> index.add(u'one two three four five six seven eight', 'c')
+>>> index.add(u'nine ten eleven twelve thirteen fourteen fifteen', 'd')
+>>> len(index)
+2
+
+# Comments on closed articles are archived once they are old enough. The
+# copies keep their author data, and the entries of their users are moved to
+# the archive in one statement.
+>>> b.archive_comments()
+0
+>>> authors = sorted(ArticleComment.objects.values_list('pk', 'author_name'))
+>>> User.objects.filter(pk=user.pk).update(first_name=u'Renamed')
+1
+>>> recorder = profiling.QueryRecorder()
+>>> recorder.install()
+>>> b.archive_comments(now=datetime.datetime.now() + datetime.timedelta(days=400))
+2
+>>> recorder.uninstall()
+>>> [q['sql'].split()[0] for q in recorder.queries
+...  if 'simple_comments_usercommentactivity' in q['sql']]
+['UPDATE']
+>>> archived = ArchivedArticleComment.objects.values_list('pk', 'author_name')
+>>> sorted(archived) == authors
+True
+>>> User.objects.filter(pk=user.pk).update(first_name=user.first_name)
+1
+>>> ArticleComment.objects.count()
+0
+>>> ArchivedArticleComment.objects.filter(target=article).count()
+2
+
+# Archived comments are listed on the pages following the live comments,
+# starting on the first page once all comments have been archived.
+>>> response = Client().get('/comments/articles/%d/' % article.pk)
+>>> [response.context[key] for key in ('is_archive', 'page', 'pages')]
+[True, 1, 1]
+>>> [c.body for c in response.context['comment_list']]
+[u'comment', u'']
+>>> Client().get('/comments/articles/%d/?page=2' % article.pk).status_code
+404
+
+# Reads go to the replica until a comment has been posted, after which the
+# session is pinned to the primary for a while.
+>>> class Request(object):
+...     session = {}
+>>> request = Request()
+>>> b.read_database = 'replica'
+>>> b.get_read_database(request)
+'replica'
+>>> b.pin_to_write_database(request)
+>>> b.get_read_database(request)
+'default'
+>>> b.read_database = None
+
+# Comments can be sharded by target.
+>>> sharded = ArticleCommentConfig('sharded', ArticleComment,
+...                                lambda pk: 'shard%d' % (pk % 2))
+>>> sharded.get_write_database(article)
+'shard1'
+>>> sharded.get_read_database(None, 2)
+'shard0'
+>>> sharded.get_read_database(None, u'2')
+'shard0'
+
+# Target ids taken from URLs are converted before being handed to the shard
+# function.
+>>> comments.register('sharded', ArticleComment, ArticleCommentConfig,
+...                   lambda pk: ('default', 'default')[pk % 2])
+>>> Client().get('/comments/sharded/%d/' % article.pk).status_code
+200
+>>> comments.unregister('sharded')
+
+# Targets aren't stored on shards, so comments there are neither joined with
+# their targets nor filtered on target fields.
+>>> comments.register('onshard', ArticleComment, ArticleCommentConfig, 'shard')
+>>> onshard = comments.get_configuration('onshard')
+>>> sharded_comment = ArticleComment(target=article, user=user, body='shard')
+>>> sharded_comment.save(using='shard')
+>>> response = Client().get('/comments/onshard/%d/' % article.pk)
+>>> [c.body for c in response.context['comment_list']]
+[u'shard']
+>>> onshard.archive_comments(
+...     now=datetime.datetime.now() + datetime.timedelta(days=400))
+1
+>>> ArchivedArticleComment.objects.using('shard').count()
+1
+>>> comments.unregister('onshard')
+
+# In ingest mode comments are buffered and saved in bulk.
+>>> class IngestConfig(ArticleCommentConfig):
+...     ingest_mode = True
+>>> ingesting = IngestConfig('ingesting', ArticleComment)
+>>> c3 = ArticleComment(target=article, user=user, body='buffered')
+>>> c3.denormalize_user_instance()
+>>> ingesting.ingest_buffer.add(c3)
+>>> ArticleComment.objects.filter(body='buffered').count()
+0
+>>> ingesting.ingest_buffer.get_duplicate(c3) is c3
+True
+>>> recorder = profiling.QueryRecorder()
+>>> recorder.install()
+>>> ingesting.ingest_buffer.flush()
+1
+>>> recorder.uninstall()
+>>> [q['sql'].split()[:3] for q in recorder.queries]
+[['INSERT', 'INTO', '"articles_articlecomment"'], ['INSERT', 'INTO', '"simple_comments_usercommentactivity"']]
+>>> ArticleComment.objects.filter(body='buffered').count()
+1
+
+# Comments that fail to save are put back in the buffer and only dropped
+# after ``ingest_max_attempts`` attempts.
+>>> class BrokenIngestConfig(IngestConfig):
+...     ingest_flush_interval = 60 * 1000
+...     def get_write_database(self, target=None):
+...         return 'missing'
+>>> broken = BrokenIngestConfig('broken', ArticleComment)
+>>> c4 = ArticleComment(target=article, user=user, body='unsaved')
+>>> c4.denormalize_user_instance()
+>>> broken.ingest_buffer.add(c4)
+>>> broken.ingest_buffer.flush(), len(broken.ingest_buffer), c4.pk
+(1, 1, None)
+>>> broken.ingest_buffer.flush(), broken.ingest_buffer.flush()
+(1, 1)
+>>> len(broken.ingest_buffer)
+0
+
+# Recent comments of all configurations are merged newest first.
+>>> class Item(object):
+...     def __init__(self, pk, day):
+...         self.pk = pk
+...         self.pub_date = datetime.datetime(2010, 1, day)
+>>> merged = recent.merge([('a', [Item(3, 5), Item(1, 2)]),
+...                        ('b', [Item(2, 4), Item(9, 1)])])
+>>> [(c.configuration_key, c.pk) for c in merged]
+[('a', 3), ('b', 2), ('a', 1), ('b', 9)]
+>>> item = Item(2, 4)
+>>> item.configuration_key = 'b'
+>>> recent.parse_cursor(recent.get_cursor(item))
+(datetime.datetime(2010, 1, 4, 0, 0), 'b', 2)
+
+# Comments can be iterated over in fixed size chunks.
+>>> ArticleComment(target=article, user=user, body='streamed').save()
+>>> [c.body for c in b.iter_comments(target=article, chunk_size=1)]
+[u'buffered', u'streamed']
+>>> b.order_by = '-pub_date'
+>>> [c.body for c in b.iter_comments(target=article, chunk_size=1)]
+[u'streamed', u'buffered']
+>>> b.order_by = 'pub_date'
+
+# Targets are looked up once per request, and whether they allow comments is
+# only determined once per request and target, whatever the instance.
+>>> request = Request()
+>>> target = b.get_target(request, article.pk)
+>>> b.get_target(request, article.pk) is target
+True
+>>> b.memoized_allow_comments(request, target)
+False
+>>> other = Article.objects.get(pk=article.pk)
+>>> other.pub_date = datetime.datetime.now()
+>>> b.allow_comments(other), b.memoized_allow_comments(request, other)
+(True, False)
+>>> b.memoized_allow_comments(Request(), other)
+True
+
+# Comments awaiting moderation are never listed until they are approved.
+>>> pending = ArticleComment(target=article, user=user, body='pending',
+...                          status=ArticleComment.PENDING)
+>>> pending.save()
+>>> [c.body for c in b.get_queryset(target=article)]
+[u'buffered', u'streamed']
+>>> b.moderate_comments([pending.pk], ArticleComment.PUBLIC)
+1
+>>> [c.body for c in b.get_queryset(target=article)]
+[u'buffered', u'streamed', u'pending']
+
+# The last page of live comments links to the archive.
+>>> response = Client().get('/comments/articles/%d/' % article.pk)
+>>> [response.context[key] for key in ('is_archive', 'has_archive',
+...                                    'has_next', 'pages')]
+[False, True, True, 1]
+>>> response = Client().get('/comments/articles/%d/?page=2' % article.pk)
+>>> [response.context[key] for key in ('is_archive', 'page', 'pages')]
+[True, 2, 2]
+
+# Public comments are indexed by target and publication date.
+>>> cursor = connection.cursor()
+>>> result = cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s",
+...                         ['articles_articlecomment_public'])
+>>> sql = cursor.fetchone()[0]
+>>> '("target_id", "pub_date") WHERE "status" = 1' in sql
+True
+
+# So is the moderation queue.
+>>> result = cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s",
+...                         ['articles_articlecomment_pending'])
+>>> sql = cursor.fetchone()[0]
+>>> '("id") WHERE "status" = 0' in sql
+True
+
+# Comments by registered users are indexed per user. ArticleComment is used
+# by both the 'article' and 'articles' configurations, and is always indexed
+# under the first of them.
+>>> pending_pk = pending.pk
+>>> entry = UserCommentActivity.objects.get(user=user, comment_id=pending_pk)
+>>> entry.configuration_key, entry.database
+(u'article', u'default')
+>>> [c.body for c in UserCommentActivity.objects.get_comments(
+...     UserCommentActivity.objects.for_user(user)[:1])]
+[u'pending']
+>>> pending.delete()
+>>> UserCommentActivity.objects.filter(user=user, comment_id=pending_pk).count()
+0
+
+# Archived comments keep their primary keys, which SQLite hands out again to
+# new comments, and are indexed apart from them.
+>>> entries = UserCommentActivity.objects.filter(configuration_key='article',
+...                                              database='default',
+...                                              comment_id=1)
+>>> entries = entries.order_by('archived')
+>>> [(e.archived, c.body) for (e, c) in zip(entries,
+...  UserCommentActivity.objects.get_comments(entries))]
+[(False, u'buffered'), (True, u'comment')]
+
+# Saving a new comment only inserts an entry for comments by users.
+>>> recorder = profiling.QueryRecorder()
+>>> recorder.install()
+>>> anonymous = ArticleComment.objects.create(target=article, body=u'anon',
+...     author_name=u'Anon', author_email=u'anon@example.com')
+>>> signed = ArticleComment.objects.create(target=article, user=user,
+...                                        body=u'signed')
+>>> recorder.uninstall()
+>>> [q['sql'].split()[0] for q in recorder.queries
+...  if 'simple_comments_usercommentactivity' in q['sql']]
+['INSERT']
+>>> anonymous.delete(); signed.delete()
+
+# Comments of a model used by several configurations are only listed once.
+>>> [(c.configuration_key, c.body) for c in recent.get_recent_comments(10)]
+[('article', u'streamed'), ('article', u'buffered')]
+
+# profiling tests
+
+# Only frames from simple_comments, outside the profiling module, are kept.
+>>> stack = [('/usr/lib/django/db/models/query.py', 1, 'count', ''),
+...          (os.path.join(profiling.PACKAGE_DIR, 'comments.py'), 2,
+...           'get_queryset', ''),
+...          (os.path.join(profiling.PACKAGE_DIR, 'profiling.py'), 3,
+...           'record', '')]
+>>> [o.endswith('comments.py:2 in get_queryset') for o in
+...  profiling.get_origin(stack)]
+[True]
+
+# Queries that aren't made from simple_comments are ignored.
+>>> recorder = profiling.QueryRecorder()
+>>> recorder.record('default', 'SELECT 1', (), 0.5)
+>>> recorder.queries
+[]
+>>> recorder.install()
+>>> ArticleCommentConfig('profile', ArticleComment).sync_user_fields(user)
+0
+>>> recorder.uninstall()
+>>> query = recorder.queries[-1]
+>>> query['database'], query['sql'].startswith('SELECT')
+('default', True)
+>>> 'comments.py' in query['origin'], query['duration'] >= 0
+(True, True)
+
+>>> profile_dir = profiling.PROFILE_DIR
+>>> profiling.PROFILE_DIR = tempfile.mkdtemp()
+>>> request = HttpRequest()
+>>> request.path, request.method = '/articles/1/', 'GET'
+>>> profiler = cProfile.Profile()
+>>> profiler.runcall(len, 'abc')
+3
+>>> profile_id = profiling.save_profile(request, profiler, [{
+...     'database': 'default', 'sql': 'SELECT %s', 'params': (1,),
+...     'duration': 2.0, 'origin': 'comments.py:2', 'stack': []}], 0.005)
+>>> [(p['id'] == profile_id, p['path'], p['duration'],
+...   p['queries'][0]['params']) for p in profiling.load_profiles()]
+[(True, u'/articles/1/', 5.0, [u'1'])]
+
+# The profile of a streamed response is stored once it has been consumed.
+>>> sample_rate = profiling.SAMPLE_RATE
+>>> profiling.SAMPLE_RATE = 1.0
+>>> middleware = profiling.ProfilingMiddleware()
+>>> middleware.process_request(request)
+>>> response = middleware.process_response(request,
+...                                        HttpResponse(iter(['a', 'b'])))
+>>> len(profiling.load_profiles())
+1
+>>> ''.join(response)
+'ab'
+>>> len(profiling.load_profiles())
+2
+
+# Other responses are stored right away.
+>>> middleware.process_request(request)
+>>> response = middleware.process_response(request, object())
+>>> len(profiling.load_profiles())
+3
+>>> profiling.SAMPLE_RATE = sample_rate
+
+# Only the newest profiles are kept, in a directory only the owner can read.
+>>> shutil.rmtree(profiling.PROFILE_DIR)
+>>> max_profiles = profiling.MAX_PROFILES
+>>> profiling.MAX_PROFILES = 2
+>>> profile_ids = []
+>>> for i in range(3):
+...     profile_ids.append(profiling.save_profile(request, profiler, [], 0.001))
+...     time.sleep(0.002)
+>>> sorted([p['id'] for p in profiling.load_profiles()]) == profile_ids[1:]
+True
+>>> sorted(os.listdir(profiling.PROFILE_DIR)) == sorted(
+...     ['%s.%s' % (i, e) for i in profile_ids[1:] for e in ('json', 'prof')])
+True
+>>> oct(os.stat(profiling.PROFILE_DIR).st_mode & 0777)
+'0700'
+>>> profiling.MAX_PROFILES = max_profiles
+>>> shutil.rmtree(profiling.PROFILE_DIR)
+>>> profiling.PROFILE_DIR = profile_dir
+
 
 """
 
+import os
+import shutil
+import time
+import cProfile
 import datetime
+import tempfile
 
 from django import forms
+from django.conf import settings
+from django.core.management import call_command
 from django.db import models
+from django.db import connection
 from django.contrib.auth.models import User
+from django.http import HttpRequest, HttpResponse
+from django.test.client import Client
 
 from simple_comments.forms import AkismetForm
+from simple_comments.models import UserCommentActivity
+from simple_comments.duplicates import MinHashIndex
 from simple_comments import comments
+from simple_comments import recent
+from simple_comments import profiling
 
 from example.articles.models import Article
 from example.articles.models import ArticleComment
+from example.articles.models import ArchivedArticleComment
 from example.articles.models import ArticleCommentConfig
 
 __test__ = { 'doctest': tests }
@@ -6,9 +6,19 @@ DEBUG_PROPAGATE_EXCEPTIONS = DEBUG
 
 USE_I18N = True
  
-DATABASE_ENGINE = 'sqlite3'
-DATABASE_NAME = ':memory:'
-# DATABASE_NAME = 'test.db'
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        # 'NAME': 'test.db',
+    },
+    # Holds the comments of sharded configurations in the tests.
+    'shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'shard.db',
+        'TEST_NAME': ':memory:',
+    },
+}
 
 TIME_ZONE = 'UTC'
     
@@ -46,4 +56,9 @@ INSTALLED_APPS = (
     'example.articles',
 )
 
+SIMPLE_COMMENTS_CONFIGURATIONS = {
+    'articles': ('example.articles.models.ArticleComment',
+                 'example.articles.models.ArticleCommentConfig'),
+}
+
 print INSTALLED_APPS
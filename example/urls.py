@@ -1,12 +1,6 @@
 from django.conf.urls.defaults import *
 from django.contrib import admin
 
-from simple_comments import comments
-
-from example.articles.models import ArticleComment
-from example.articles.models import ArticleCommentConfig
-
-comments.register('articles', ArticleComment, ArticleCommentConfig)
 admin.autodiscover()
 
 p = (
@@ -6,4 +6,6 @@ from distutils.core import setup
 setup(name='simple_comments', version='0.1',
       description='Simple reusable Django comments app',
       author='Gustaf Sjöberg', author_email='gs@distrop.com',
-      packages=['simple_comments', 'simple_comments.templatetags'])
+      packages=['simple_comments', 'simple_comments.templatetags',
+                'simple_comments.management',
+                'simple_comments.management.commands'])
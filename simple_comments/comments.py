@@ -1,17 +1,36 @@
+import imp
+import sys
+import time
+import logging
 import datetime
+import threading
 
 from django import http
 from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, InvalidPage
+from django.db import transaction
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.forms.forms import NON_FIELD_ERRORS
 from django.forms.models import modelform_factory
 from django.shortcuts import get_object_or_404
+from django.template import loader, RequestContext
 from django.views.generic.list_detail import object_list
 from django.views.generic.simple import direct_to_template
 from django.core.urlresolvers import reverse
+from django.utils.importlib import import_module
 
 from simple_comments import forms as comment_forms
+from simple_comments import duplicates
+from simple_comments import ingest
 
 NOTIFICATION_LABEL = 'simple_comments_comment'
 
+PINNED_SESSION_KEY = 'simple_comments_pinned_until'
+
+logger = logging.getLogger('simple_comments')
+
 class CommentConfiguration(object):
     """A set of basic configuration options for handling comments. Subclass
     this class to create your own custom behaviour.
@@ -36,6 +55,12 @@ class CommentConfiguration(object):
 
     ``prevent_duplicates`` dictates whether some measures should be taken
     against duplicate comments.
+
+    ``prevent_near_duplicates`` enables rejection of comments whose body is
+    very similar to a recently posted comment, regardless of author, target
+    or configuration. ``near_duplicate_threshold`` is the estimated
+    similarity (between 0 and 1) at which a comment is rejected, in which
+    case the form is shown again with ``near_duplicate_message``.
     
     ``allow_comments_field_name`` is a boolean field on the target model that,
     when evaluating to ``False``, prevents comments from being posted.
@@ -43,14 +68,65 @@ class CommentConfiguration(object):
     ``send_notifications`` dictates whether notifications should be sent or
     not.
 
+    ``require_moderation`` holds new comments back until a moderator approves
+    them in the ``moderation_queue`` view. Only public comments are ever
+    listed.
+
+    ``archive_model`` is a ``BaseComment`` subclass with the same ``target``
+    as ``model`` that old comments are moved to by the ``archive_comments``
+    management command. Comments older than ``archive_after`` days are
+    archived once their target no longer allows comments. They are moved in
+    batches of ``archive_batch_size``. ``comment_list`` serves the archive
+    when a page past the last page of live comments is requested, which makes
+    most sense when ``order_by`` lists the newest comments first.
+
+    ``read_database`` and ``write_database`` are database aliases that
+    comments are read from and written to. ``None`` leaves the decision to
+    the database routers. After posting a comment a user's session reads
+    from ``write_database`` for ``read_your_writes_timeout`` seconds, so that
+    the new comment is shown despite replication lag. Install
+    ``simple_comments.routers.CommentRouter`` in ``DATABASE_ROUTERS`` to have
+    queries made outside the configuration honour these options as well.
+
+    ``database`` shards comments onto a database of their own. It is either
+    an alias or a function taking the primary key of a target and returning
+    an alias, and takes precedence over ``read_database`` and
+    ``write_database``. When using a function, ``shard_databases`` must list
+    every alias it may return. Listing comments across all targets of a
+    configuration sharded by function reads from ``read_database``.
+
+    ``ingest_mode`` makes ``create_comment`` buffer valid comments in
+    process instead of saving them one by one. Buffered comments are saved
+    in bulk once ``ingest_batch_size`` comments are waiting or after
+    ``ingest_flush_interval`` milliseconds, and posters are redirected to a
+    page saying their comment is pending. Comments that fail to save are
+    logged and retried with the next flush, at most ``ingest_max_attempts``
+    times.
+
+    ``comment_stream`` renders every comment on a target without keeping
+    them all in memory, fetching ``stream_chunk_size`` comments at a time
+    and rendering each with ``stream_item_template_name`` between the
+    header and footer templates. Streamed comments are ordered by primary
+    key rather than ``order_by``.
+
+    ``target_cache_timeout`` is the number of seconds targets looked up by
+    the views are cached for. Within a request each target is looked up only
+    once, and whether it allows comments and who owns it are only determined
+    once per target instance.
+
     """
     template_object_name = 'comment'
 
     preview_template_name = 'simple_comments/comment_preview.html'
     form_template_name = 'simple_comments/comment_form.html'
     list_template_name = 'simple_comments/comment_list.html'
-    deleted_template_namae = 'simple_comments/comment_deleted.html'
+    deleted_template_name = 'simple_comments/comment_deleted.html'
     posted_template_name = 'simple_comments/comment_posted.html'
+    moderation_template_name = 'simple_comments/moderation_queue.html'
+    pending_template_name = 'simple_comments/comment_pending.html'
+    stream_header_template_name = 'simple_comments/comment_stream_header.html'
+    stream_item_template_name = 'simple_comments/comment_stream_item.html'
+    stream_footer_template_name = 'simple_comments/comment_stream_footer.html'
     
     use_akismet = False
     use_control_question = False
@@ -63,21 +139,235 @@ class CommentConfiguration(object):
     autoclose_after_field_name = None
     
     prevent_duplicates = True
+
+    prevent_near_duplicates = False
+    near_duplicate_threshold = 0.8
+    near_duplicate_message = u"A very similar comment was posted " \
+                             u"recently."
     
     allow_comments_field_name = None
     
     send_notifications = False
 
-    # require_moderation = False
+    archive_model = None
+    archive_after = None
+    archive_batch_size = 500
+
+    read_database = None
+    write_database = None
+    read_your_writes_timeout = 10
+
+    database = None
+    shard_databases = ()
+
+    ingest_mode = False
+    ingest_batch_size = 100
+    ingest_flush_interval = 500
+    ingest_max_attempts = 3
+
+    require_moderation = False
+
     # confirm_delete = True
     # comment_markup
 
     order_by = 'pub_date'
     paginate_by = 25
+    stream_chunk_size = 500
+    target_cache_timeout = 0
 
-    def __init__(self, configuration_key, model):
+    def __init__(self, configuration_key, model, database=None):
         self.configuration_key = configuration_key
         self.model = model
+        if database is not None:
+            self.database = database
+        self.ingest_buffer = None
+        if self.ingest_mode:
+            self.ingest_buffer = ingest.IngestBuffer(self)
+
+    def get_shard_database(self, target=None):
+        """Return the alias of the shard holding comments on ``target`` (an
+        instance or a primary key), or ``None`` if comments aren't sharded.
+
+        """
+        if self.database is None:
+            return None
+        if callable(self.database):
+            if target is None:
+                return None
+            return self.database(self.get_target_pk(target))
+        return self.database
+
+    def get_target_pk(self, target):
+        """Return the primary key of ``target``, which is either a target
+        instance or a primary key in any form, such as a string taken from a
+        URL.
+
+        """
+        target_model = self.model.get_target_model()
+        if isinstance(target, target_model):
+            return target.pk
+        return target_model._meta.pk.to_python(target)
+
+    def get_databases(self):
+        """Return a list of aliases of all databases holding comments."""
+        if callable(self.database):
+            return list(self.shard_databases)
+        return [self.get_write_database()]
+
+    def get_write_database(self, target=None):
+        """Return the alias of the database comments on ``target`` are
+        written to.
+
+        """
+        shard = self.get_shard_database(target)
+        if shard is not None:
+            return shard
+        return self.write_database or DEFAULT_DB_ALIAS
+
+    def get_read_database(self, request=None, target=None):
+        """Return the alias of the database comments on ``target`` are read
+        from. Reads go to the write database while the session of
+        ``request`` is pinned to it.
+
+        """
+        shard = self.get_shard_database(target)
+        if shard is not None:
+            return shard
+        if self.read_database is not None and request is not None and \
+           self.is_pinned_to_write_database(request):
+            return self.get_write_database()
+        return self.read_database
+
+    def pin_to_write_database(self, request):
+        """Make subsequent reads in the session of ``request`` go to the
+        write database for ``read_your_writes_timeout`` seconds.
+
+        """
+        session = getattr(request, 'session', None)
+        if session is not None and self.read_database is not None:
+            session[PINNED_SESSION_KEY] = \
+                time.time() + self.read_your_writes_timeout
+
+    def is_pinned_to_write_database(self, request):
+        session = getattr(request, 'session', None)
+        if session is None:
+            return False
+        return session.get(PINNED_SESSION_KEY, 0) > time.time()
+
+    def get_queryset(self, request=None, target=None):
+        """Return a queryset of public comments, optionally limited to
+        ``target``, read from the database returned by
+        ``get_read_database()``.
+
+        """
+        database = self.get_read_database(request, target)
+        queryset = self.model.public.using(database)
+        queryset = queryset.order_by(self.order_by)
+        if target is not None:
+            queryset = queryset.filter(target=target)
+        return queryset
+
+    def select_related(self, queryset):
+        """Return ``queryset`` following the relations of comments, such as
+        their targets, in the same query. Comments on a shard are returned
+        as is, as their targets live in the default database and a join on
+        the shard would find none.
+
+        """
+        if self.database is not None:
+            return queryset
+        return queryset.select_related()
+
+    def iter_comments(self, request=None, target=None, chunk_size=None):
+        """Yield comments on ``target`` in ``order_by`` order, fetching
+        ``chunk_size`` comments per query so that memory use doesn't grow
+        with the number of comments.
+
+        Each query continues after the ``order_by`` value and primary key of
+        the last comment rather than at an offset, so it can start from the
+        index on ``(target_id, pub_date)`` instead of scanning the thread.
+
+        """
+        chunk_size = chunk_size or self.stream_chunk_size
+        field = self.order_by.lstrip('-')
+        if self.order_by.startswith('-'):
+            (pk_order, after) = ('-pk', 'lt')
+        else:
+            (pk_order, after) = ('pk', 'gt')
+        queryset = self.get_queryset(request, target)
+        queryset = queryset.order_by(self.order_by, pk_order)
+        last = None
+        while True:
+            chunk = queryset
+            if last is not None:
+                (value, pk) = last
+                # The redundant bound on ``field`` lets databases seek into
+                # the index, which they don't do for the ``OR`` alone.
+                chunk = chunk.filter(**{'%s__%se' % (field, after): value})
+                chunk = chunk.filter(
+                    Q(**{'%s__%s' % (field, after): value}) | \
+                    Q(**{field: value, 'pk__%s' % after: pk}))
+            count = 0
+            for comment in chunk[:chunk_size].iterator():
+                count += 1
+                last = (getattr(comment, field), comment.pk)
+                yield comment
+            if count < chunk_size:
+                break
+
+    def get_target(self, request, target_id):
+        """Return the target matching ``target_id`` or raise ``Http404``.
+        Targets are memoized on ``request`` and, if ``target_cache_timeout``
+        is set, cached between requests.
+
+        """
+        target_model = self.model.get_target_model()
+        opts = target_model._meta
+        key = 'simple_comments_target:%s.%s:%s' % (opts.app_label,
+                                                   opts.module_name, target_id)
+        memo = request.__dict__.setdefault('_simple_comments_targets', {})
+        if key in memo:
+            return memo[key]
+
+        target = None
+        if self.target_cache_timeout:
+            target = cache.get(key)
+        if target is None:
+            target = get_object_or_404(target_model, pk=target_id)
+            if self.target_cache_timeout:
+                cache.set(key, target, self.target_cache_timeout)
+        memo[key] = target
+        return target
+
+    def get_memoized(self, request, target, name, func):
+        """Return the result of ``func(target)``, computing it only once per
+        ``request``, target primary key and configuration. Without a
+        ``request`` the result is computed on every call.
+
+        """
+        if request is None:
+            return func(target)
+        memo = request.__dict__.setdefault('_simple_comments_memo', {})
+        key = (self.configuration_key, name, target.pk)
+        if key not in memo:
+            memo[key] = func(target)
+        return memo[key]
+
+    def memoized_allow_comments(self, request, target):
+        """Like ``allow_comments()``, but computed once per ``request`` and
+        target.
+
+        """
+        return self.get_memoized(request, target, 'allow_comments',
+                                 self.allow_comments)
+
+    def memoized_target_owner(self, request, target):
+        """Like ``get_target_owner()``, but computed once per ``request`` and
+        target.
+
+        """
+        return self.get_memoized(request, target, 'owner',
+                                 self.get_target_owner)
 
     def get_exclude(self):
         """Return a list of fields to exclude when generating a form using
@@ -89,7 +379,8 @@ class CommentConfiguration(object):
         attribute.
         
         """
-        exclude = ['user', 'user_username', 'pub_date', 'ip_address', 'target']
+        exclude = ['user', 'user_username', 'pub_date', 'ip_address', 'target',
+                   'status']
         if self.user_comments:
             exclude = exclude + ['author_name', 'author_email',
                                  'author_website']
@@ -122,6 +413,262 @@ class CommentConfiguration(object):
             return days_since < self.autoclose_after
         return True
 
+    def get_closed_targets_filter(self, now=None):
+        """Return a ``Q`` object matching targets that no longer allow
+        comments, mirroring ``allow_comments()``. Return ``None`` if targets
+        are never closed.
+
+        """
+        now = now or datetime.datetime.now()
+        closed = None
+        if self.allow_comments_field_name is not None:
+            closed = Q(**{self.allow_comments_field_name: False})
+        if self.autoclose_after_field_name is not None and \
+           self.autoclose_after is not None:
+            # Comments are closed ``autoclose_after`` days after the day the
+            # target was published, regardless of the time of day.
+            cutoff = datetime.datetime.combine(
+                now.date() - datetime.timedelta(days=self.autoclose_after - 1),
+                datetime.time())
+            lookup = '%s__lt' % self.autoclose_after_field_name
+            autoclosed = Q(**{lookup: cutoff})
+            if closed is None:
+                closed = autoclosed
+            else:
+                closed = closed | autoclosed
+        return closed
+
+    def get_closed_target_pks(self, now=None):
+        """Return the primary keys of targets that no longer allow comments.
+        Targets are looked up in their own database, as they aren't stored
+        on comment shards.
+
+        """
+        closed = self.get_closed_targets_filter(now)
+        if closed is None:
+            return []
+        target_model = self.model.get_target_model()
+        queryset = target_model._default_manager.filter(closed).order_by('pk')
+        return list(queryset.values_list('pk', flat=True))
+
+    def get_archivable_comments(self, target_pks, now=None, database=None):
+        """Return a queryset of the comments on the targets ``target_pks``
+        in ``database`` that should be moved to ``archive_model``.
+
+        """
+        database = database or self.get_write_database()
+        queryset = self.model._default_manager.using(database)
+        if self.archive_model is None or self.archive_after is None:
+            return queryset.none()
+        now = now or datetime.datetime.now()
+        cutoff = now - datetime.timedelta(days=self.archive_after)
+        return queryset.filter(target__in=target_pks, pub_date__lt=cutoff)
+
+    def archive_comments(self, batch_size=None, now=None):
+        """Move archivable comments to ``archive_model`` in batches of
+        ``batch_size``, each in its own transaction. Return the number of
+        archived comments.
+
+        """
+        if self.archive_model is None or self.archive_after is None:
+            return 0
+        batch_size = batch_size or self.archive_batch_size
+        now = now or datetime.datetime.now()
+        target_pks = self.get_closed_target_pks(now)
+        archived = 0
+        # Look comments up for a limited number of targets at a time, to
+        # keep the queries below the parameter limits of databases.
+        for i in range(0, len(target_pks), batch_size):
+            by_database = {}
+            for pk in target_pks[i:i + batch_size]:
+                database = self.get_write_database(pk)
+                by_database.setdefault(database, []).append(pk)
+            for (database, pks) in by_database.items():
+                queryset = self.get_archivable_comments(pks, now, database)
+                queryset = queryset.order_by('pk')
+                while True:
+                    batch = list(queryset[:batch_size])
+                    if not batch:
+                        break
+                    self.archive_batch(batch, database)
+                    archived += len(batch)
+        return archived
+
+    def archive_batch(self, batch, database):
+        """Copy ``batch`` to ``archive_model`` and delete the originals from
+        ``database`` in a single transaction. Primary keys are kept so that
+        links to archived comments stay valid.
+
+        """
+        from simple_comments.models import UserCommentActivity
+        def archive():
+            self.copy_comments(batch, self.archive_model, database)
+            pks = [comment.pk for comment in batch]
+            entries = UserCommentActivity.objects.filter_for_comments(
+                self.model, database, pks)
+            if entries is not None:
+                entries.update(archived=True)
+            queryset = self.model._default_manager.using(database)
+            queryset.filter(pk__in=pks).delete()
+        transaction.commit_on_success(using=database)(archive)()
+
+    def copy_comments(self, batch, model, database):
+        """Insert copies of the comments in ``batch`` as instances of
+        ``model`` into ``database``, keeping their primary keys.
+
+        Rows already in ``database`` with the same primary key, target and
+        publication date are copies left by an interrupted run and are
+        skipped. Any other row using one of the primary keys belongs to an
+        unrelated comment, in which case ``CommentCopyConflict`` is raised
+        before anything is written.
+
+        The copies are inserted as they are, without denormalizing their
+        users again or touching the activity index. Callers update the
+        entries of the batch.
+
+        """
+        pks = [comment.pk for comment in batch]
+        existing = model._default_manager.using(database).filter(pk__in=pks)
+        existing = dict([(pk, (target_id, pub_date)) for \
+                         (pk, target_id, pub_date) in \
+                         existing.values_list('pk', 'target', 'pub_date')])
+        for comment in batch:
+            if comment.pk in existing and existing[comment.pk] != \
+               (comment.target_id, comment.pub_date):
+                raise CommentCopyConflict(
+                    u"Comment %s already exists in %s (%s)" % \
+                    (comment.pk, model._meta.object_name, database))
+        fields = [f.attname for f in self.model._meta.fields]
+        for comment in batch:
+            if comment.pk in existing:
+                continue
+            values = dict([(name, getattr(comment, name)) for name in fields])
+            model(**values).save_base(raw=True, force_insert=True,
+                                      using=database)
+
+    def rebalance_comments(self, from_database, to_database, batch_size=500):
+        """Move comments from ``from_database`` to ``to_database`` in
+        batches of ``batch_size``. When sharding by function only comments
+        whose target now maps to ``to_database`` are moved. Return the
+        number of moved comments.
+
+        Each batch is committed to the new database before being deleted
+        from the old one, and copies left by an interrupted run are
+        recognized, so the run can safely be repeated. Primary keys are kept,
+        so ``CommentCopyConflict`` is raised if the new database already
+        holds other comments with the same primary keys.
+
+        """
+        from simple_comments.models import UserCommentActivity
+        source = self.model._default_manager.using(from_database)
+        source = source.order_by('pk')
+        moved = 0
+        last_pk = None
+        while True:
+            queryset = source
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            if callable(self.database):
+                batch = [c for c in batch if \
+                         self.get_shard_database(c.target_id) == to_database]
+            if not batch:
+                continue
+            copy = transaction.commit_on_success(using=to_database)
+            copy(self.copy_comments)(batch, self.model, to_database)
+            pks = [comment.pk for comment in batch]
+            # Move the entries before deleting the originals, so that a
+            # repeated run still finds the comments whose entries it missed.
+            entries = UserCommentActivity.objects.filter_for_comments(
+                self.model, from_database, pks)
+            if entries is not None:
+                entries.update(database=to_database)
+            source.filter(pk__in=pks).delete()
+            moved += len(batch)
+        return moved
+
+    def get_archive_queryset(self, request=None, target_id=None):
+        """Return a queryset of archived comments, or ``None`` if comments
+        aren't archived.
+
+        """
+        if self.archive_model is None:
+            return None
+        database = self.get_read_database(request, target_id)
+        queryset = self.archive_model.public.using(database)
+        queryset = self.select_related(queryset)
+        queryset = queryset.order_by(self.order_by)
+        if target_id is not None:
+            queryset = queryset.filter(target=target_id)
+        return queryset
+
+    def persist_comments(self, batch):
+        """Save the comments in ``batch``, which may be spread over several
+        shards, using one transaction per database, and send notifications
+        for the saved comments.
+
+        Each comment costs one ``INSERT``, plus one ``INSERT`` into the
+        activity index if it was posted by a registered user. Nothing is
+        read, updated or deleted.
+
+        Return the comments that couldn't be saved. Failures are logged and
+        don't affect the comments bound for other databases.
+
+        """
+        by_database = {}
+        for comment in batch:
+            database = self.get_write_database(comment.target_id)
+            by_database.setdefault(database, []).append(comment)
+        saved = []
+        failed = []
+        for (database, comments) in by_database.items():
+            def save():
+                for comment in comments:
+                    comment.save(force_insert=True, using=database)
+            try:
+                transaction.commit_on_success(using=database)(save)()
+            except Exception:
+                logger.exception("Failed to persist %d buffered comments to "
+                                 "database '%s'" % (len(comments), database))
+                # The transaction was rolled back, so forget the primary keys
+                # handed out inside it.
+                for comment in comments:
+                    comment.pk = None
+                failed.extend(comments)
+            else:
+                saved.extend(comments)
+        for comment in saved:
+            self.dispatch_notifications(comment)
+        return failed
+
+    def sync_user_fields(self, user, batch_size=500):
+        """Copy the current name, email and username of ``user`` onto all
+        comments, live and archived, posted by ``user`` that are out of date.
+        Rows are updated in chunks of ``batch_size`` using set-based updates.
+        Return the number of updated comments.
+
+        """
+        fields = self.model.get_denormalized_user_fields(user)
+        models = [m for m in (self.model, self.archive_model) if m]
+        updated = 0
+        for database in self.get_databases():
+            for model in models:
+                queryset = model._default_manager.using(database)
+                queryset = queryset.filter(user=user)
+                stale = queryset.exclude(**fields).order_by()
+                while True:
+                    pks = list(stale.values_list('pk', flat=True)[:batch_size])
+                    if not pks:
+                        break
+                    count = queryset.filter(pk__in=pks).update(**fields)
+                    if not count:
+                        break
+                    updated += count
+        return updated
+
     def get_target_owner(self, target):
         """Return the owner (``User`` instance) of target."""
         return None
@@ -143,7 +690,11 @@ class CommentConfiguration(object):
             'author_website': comment.author_website,
             'target': target,
         }
-        queryset = comment._default_manager.filter(**filter_kwargs)
+        # Look at the write database to avoid missing a duplicate that
+        # hasn't been replicated yet.
+        database = self.get_write_database(target)
+        queryset = comment._default_manager.using(database)
+        queryset = queryset.filter(**filter_kwargs)
         queryset = queryset.order_by('-pub_date')
         if queryset.count():
             latest = queryset[0]
@@ -151,12 +702,75 @@ class CommentConfiguration(object):
                latest.body == comment.body:
                 return latest
         return None
+
+    def get_near_duplicate_index(self):
+        """Return the ``MinHashIndex`` used to find near duplicates. The
+        index is shared by all configurations by default.
+
+        """
+        return duplicates.index
+
+    def get_near_duplicate(self, target, comment):
+        """Return a ``(similarity, configuration_key)`` tuple if a comment
+        very similar to ``comment`` was recently posted using any
+        configuration sharing the index. Otherwise return ``None``.
+
+        """
+        index = self.get_near_duplicate_index()
+        return index.query(comment.body, self.near_duplicate_threshold)
+
+    def record_near_duplicate(self, target, comment):
+        """Add ``comment`` to the near duplicate index."""
+        index = self.get_near_duplicate_index()
+        index.add(comment.body, self.configuration_key)
     
+    def has_permission_to_moderate(self, user):
+        """Return a boolean dictating whether ``user`` may approve and
+        reject comments.
+
+        """
+        if user is None or user.is_anonymous():
+            return False
+        opts = self.model._meta
+        return user.has_perm('%s.%s' % (opts.app_label,
+                                        opts.get_change_permission()))
+
+    def get_moderation_database(self, request):
+        """Return the alias of the database to moderate. Configurations
+        sharded by function moderate one shard at a time, picked by the
+        ``database`` query parameter.
+
+        """
+        database = request.REQUEST.get('database')
+        if callable(self.database) and database in self.shard_databases:
+            return database
+        return self.get_databases()[0]
+
+    def moderate_comments(self, comment_ids, status, database=None):
+        """Set the status of the pending comments matching
+        ``comment_ids`` to ``status`` using a single query. Return the number
+        of moderated comments.
+
+        """
+        database = database or self.get_write_database()
+        queryset = self.model._default_manager.using(database)
+        queryset = queryset.filter(pk__in=comment_ids,
+                                   status=self.model.PENDING)
+        return queryset.update(status=status)
+
     def get_post_save_redirect_url(self, target, comment):
         """Return a URL to redirect to after a successful comment save."""
         return reverse('simple_comments_comment_posted',
                        args=[self.configuration_key, target.pk, comment.pk])
             
+    def get_post_enqueue_redirect_url(self, target, comment):
+        """Return a URL to redirect to after a comment has been buffered in
+        ingest mode.
+
+        """
+        return reverse('simple_comments_comment_pending',
+                       args=[self.configuration_key, target.pk])
+
     def get_post_delete_redirect_url(self, target):
         """Return a URL to redirect to after a successful comment delete."""
         return reverse('simple_comments_comment_deleted',
@@ -189,10 +803,11 @@ class CommentConfiguration(object):
         if user is None or user.is_anonymous():
             return False
 
-        target_owner = self.get_target_owner(comment.target)
-        if self.user_can_delete and \
-           (comment.user == user or target_owner == user):
-            return True
+        if self.user_can_delete:
+            if comment.user_id == user.pk:
+                return True
+            if self.memoized_target_owner(request, comment.target) == user:
+                return True
 
         if request is not None:
             opts = comment.target._meta
@@ -209,9 +824,11 @@ class CommentConfiguration(object):
         return [self.get_target_owner(target)]
 
     def dispatch_notifications(self, comment):
-        users = self.get_notification_users(comment.target)
         if not self.send_notifications or \
-           "notification" not in settings.INSTALLED_APPS or not users:
+           "notification" not in settings.INSTALLED_APPS:
+            return False
+        users = self.get_notification_users(comment.target)
+        if not users:
             return False
 
         from notification import models as notification
@@ -225,9 +842,9 @@ class CommentConfiguration(object):
     # Views
 
     def create_comment(self, request, target_id, extra_context=None):
-        target = get_object_or_404(self.model.get_target_model(), pk=target_id)
+        target = self.get_target(request, target_id)
 
-        if not self.allow_comments(target) or \
+        if not self.memoized_allow_comments(request, target) or \
            (self.user_comments and not request.user.is_authenticated()):
             return http.HttpResponseForbidden()
 
@@ -267,6 +884,8 @@ class CommentConfiguration(object):
 
         comment.target = target
         comment.ip_address = request.META.get("REMOTE_ADDR", None)
+        if self.require_moderation:
+            comment.status = self.model.PENDING
         extra_context = extra_context or {}
         extra_context.update({ self.template_object_name: comment })
 
@@ -278,20 +897,45 @@ class CommentConfiguration(object):
         # Try to prevent accidental duplicate postings by finding a *very*
         # similar comment and use that instead of saving a new one.
         duplicate = self.get_duplicate(target, comment)
+        if duplicate is None and self.ingest_buffer is not None:
+            duplicate = self.ingest_buffer.get_duplicate(comment)
+        # Comments still waiting in the ingest buffer have no primary key.
+        # Notifications for them are sent once they have been persisted.
+        is_buffered = False
         if duplicate is not None:
             comment = duplicate
+            is_buffered = comment.pk is None
         else:
-            comment.save()
-
-        self.dispatch_notifications(comment)
+            if self.prevent_near_duplicates:
+                if self.get_near_duplicate(target, comment) is not None:
+                    errors = form._errors.setdefault(NON_FIELD_ERRORS,
+                                                     form.error_class())
+                    errors.append(self.near_duplicate_message)
+                    return direct_to_template(request,
+                                              template=self.form_template_name,
+                                              extra_context=extra_context)
+                self.record_near_duplicate(target, comment)
+            if self.ingest_buffer is not None:
+                self.ingest_buffer.add(comment)
+                is_buffered = True
+            else:
+                comment.save(using=self.get_write_database(target))
+                self.pin_to_write_database(request)
 
-        post_save_redirect_url = self.get_post_save_redirect_url(target,
-                                                                 comment)
-        return http.HttpResponseRedirect(post_save_redirect_url)
+        if is_buffered:
+            redirect_url = self.get_post_enqueue_redirect_url(target, comment)
+        else:
+            self.dispatch_notifications(comment)
+            redirect_url = self.get_post_save_redirect_url(target, comment)
+        return http.HttpResponseRedirect(redirect_url)
 
     def delete_comment(self, request, target_id, comment_id):
-        target = get_object_or_404(self.model.get_target_model(), pk=target_id)
-        comment = get_object_or_404(self.model, pk=comment_id)
+        target = self.get_target(request, target_id)
+        database = self.get_write_database(target)
+        queryset = self.model._default_manager.using(database)
+        comment = get_object_or_404(queryset, pk=comment_id, target=target)
+        # Share the target instance fetched above.
+        comment.target = target
 
         if not self.has_permission_to_delete(comment, request.user, request):
             return http.HttpResponseForbidden()
@@ -299,40 +943,205 @@ class CommentConfiguration(object):
         comment.delete()
 
         post_delete_redirect_url = \
-            config.get_post_delete_redirect_url(target)
+            self.get_post_delete_redirect_url(target)
         return http.HttpResponseRedirect(post_delete_redirect_url)
 
     def comment_list(self, request, target_id=None, extra_context=None):
-        queryset = self.model._default_manager.all().select_related()
-        queryset = queryset.order_by(self.order_by)
+        """List comments, continuing with archived comments after the live
+        ones when ``archive_model`` is set.
 
-        if target_id is not None:
-            queryset = queryset.filter(target=target_id)
+        Archive pages are numbered after the live pages, and start on the
+        first page once all comments on a target have been archived. The
+        ``has_archive`` context variable tells whether archived comments may
+        follow; the last live page then has a next page. As the archive is
+        only counted when one of its pages is shown, ``pages`` only counts
+        the live pages on those.
+
+        """
+        queryset = self.select_related(self.get_queryset(request, target_id))
 
         extra_context = extra_context or {}
         extra_context.update({
             'target_id': target_id,
             'configuration': self,
+            'is_archive': False,
+            'has_archive': False,
         })
 
-        return object_list(request, queryset=queryset,
-                           paginate_by=self.paginate_by,
-                           template_object_name=self.template_object_name,
-                           template_name=self.list_template_name,
-                           extra_context=extra_context)
+        archive_queryset = self.get_archive_queryset(request, target_id)
+        if archive_queryset is None or not self.paginate_by:
+            return object_list(request, queryset=queryset,
+                               paginate_by=self.paginate_by,
+                               template_object_name=self.template_object_name,
+                               template_name=self.list_template_name,
+                               extra_context=extra_context)
+        extra_context['has_archive'] = True
+
+        paginator = Paginator(queryset, self.paginate_by)
+        hot_pages = paginator.count and paginator.num_pages
+        archive_paginator = Paginator(archive_queryset, self.paginate_by,
+                                      allow_empty_first_page=not hot_pages)
+        page = request.GET.get('page', 1)
+        try:
+            if page == 'last':
+                page = hot_pages + archive_paginator.num_pages
+            page = int(page)
+            if page <= hot_pages:
+                return self.render_comment_page(request, paginator.page(page),
+                                                0, hot_pages, True,
+                                                extra_context)
+            page_obj = archive_paginator.page(page - hot_pages)
+        except (ValueError, InvalidPage):
+            raise http.Http404
+
+        extra_context.update({
+            'is_archive': True,
+            'archive_page_offset': hot_pages,
+        })
+        return self.render_comment_page(
+            request, page_obj, hot_pages,
+            hot_pages + archive_paginator.num_pages, page_obj.has_next(),
+            extra_context)
+
+    def render_comment_page(self, request, page_obj, offset, pages, has_next,
+                            extra_context):
+        """Render ``page_obj`` with ``list_template_name``, providing the
+        pagination variables of the ``object_list`` generic view. Page
+        numbers are shifted by ``offset`` pages.
+
+        """
+        number = offset + page_obj.number
+        context = RequestContext(request, {
+            '%s_list' % self.template_object_name: page_obj.object_list,
+            'paginator': page_obj.paginator,
+            'page_obj': page_obj,
+            'is_paginated': pages > 1 or has_next,
+            'results_per_page': self.paginate_by,
+            'has_next': has_next,
+            'has_previous': number > 1,
+            'page': number,
+            'next': number + 1,
+            'previous': number - 1,
+            'pages': pages,
+            'page_range': range(1, pages + 1),
+        })
+        for (key, value) in extra_context.items():
+            if callable(value):
+                context[key] = value()
+            else:
+                context[key] = value
+        template = loader.get_template(self.list_template_name)
+        return http.HttpResponse(template.render(context))
+
+    def comment_stream(self, request, target_id, extra_context=None):
+        target = self.get_target(request, target_id)
+        extra_context = extra_context or {}
+        extra_context.update({
+            'target': target,
+            'configuration': self,
+        })
+        content = self.render_comment_stream(request, target, extra_context)
+        # Django versions without StreamingHttpResponse stream iterators
+        # passed to HttpResponse, provided no middleware consumes them.
+        response_class = getattr(http, 'StreamingHttpResponse',
+                                 http.HttpResponse)
+        return response_class(content)
+
+    def render_comment_stream(self, request, target, extra_context):
+        """Yield the rendered header, each comment on ``target`` and the
+        footer.
+
+        """
+        header = loader.get_template(self.stream_header_template_name)
+        item = loader.get_template(self.stream_item_template_name)
+        footer = loader.get_template(self.stream_footer_template_name)
+        context = RequestContext(request, extra_context)
+        yield header.render(context)
+        for comment in self.iter_comments(request, target):
+            context.push()
+            context[self.template_object_name] = comment
+            yield item.render(context)
+            context.pop()
+        yield footer.render(context)
+
+    def moderation_queue(self, request, extra_context=None):
+        """List pending comments oldest first and approve or reject the
+        posted ``comment_id`` values in bulk. Pages are continued with the
+        ``after`` query parameter rather than an offset.
+
+        """
+        if not self.has_permission_to_moderate(request.user):
+            return http.HttpResponseForbidden()
+
+        database = self.get_moderation_database(request)
+
+        if request.method == 'POST':
+            actions = {
+                'approve': self.model.PUBLIC,
+                'reject': self.model.REJECTED,
+            }
+            status = actions.get(request.POST.get('action'))
+            if status is None:
+                return http.HttpResponseBadRequest()
+            comment_ids = [int(pk) for pk in \
+                           request.POST.getlist('comment_id') if pk.isdigit()]
+            if comment_ids:
+                self.moderate_comments(comment_ids, status, database)
+            return http.HttpResponseRedirect(request.get_full_path())
+
+        queryset = self.model._default_manager.using(database)
+        queryset = queryset.filter(status=self.model.PENDING).order_by('pk')
+        after = request.GET.get('after', '')
+        if after.isdigit():
+            queryset = queryset.filter(pk__gt=int(after))
+        queryset = self.select_related(queryset)
+        comment_list = list(queryset[:self.paginate_by + 1])
+        has_next = len(comment_list) > self.paginate_by
+        comment_list = comment_list[:self.paginate_by]
+
+        extra_context = extra_context or {}
+        extra_context.update({
+            'comment_list': comment_list,
+            'has_next': has_next,
+            'next_after': has_next and comment_list[-1].pk or None,
+            'database': database,
+            'configuration': self,
+        })
+        return direct_to_template(request,
+                                  template=self.moderation_template_name,
+                                  extra_context=extra_context)
 
     def comment_posted(self, request, target_id, comment_id,
                        extra_context=None):
-        target = get_object_or_404(self.model.get_target_model(), pk=target_id)
-        comment = get_object_or_404(self.model, pk=comment_id)
+        target = self.get_target(request, target_id)
         extra_context = extra_context or {}
+        extra_context.update({
+            'target': target,
+            'comment_id': comment_id,
+            'configuration': self,
+        })
         return direct_to_template(request,
                                   template=self.posted_template_name,
                                   extra_context=extra_context)
 
+    def comment_pending(self, request, target_id, extra_context=None):
+        target = self.get_target(request, target_id)
+        extra_context = extra_context or {}
+        extra_context.update({
+            'target': target,
+            'configuration': self,
+        })
+        return direct_to_template(request,
+                                  template=self.pending_template_name,
+                                  extra_context=extra_context)
+
     def comment_deleted(self, request, target_id, extra_context=None):
-        target = get_object_or_404(self.model.get_target_model(), pk=target_id)
+        target = self.get_target(request, target_id)
         extra_context = extra_context or {}
+        extra_context.update({
+            'target': target,
+            'configuration': self,
+        })
         return direct_to_template(request,
                                   template=self.deleted_template_name,
                                   extra_context=extra_context)
@@ -346,21 +1155,127 @@ class CommentConfigurationNotRegistered(Exception):
     pass
 
 
+class CommentCopyConflict(Exception):
+    pass
+
+
+def import_object(path):
+    """Import and return the object at the dotted ``path``."""
+    (module_name, name) = path.rsplit('.', 1)
+    return getattr(import_module(module_name), name)
+
+
 class CommentConfigurations(object):
-    """Register comment models and configurations."""
+    """Register comment models and configurations.
+
+    Besides calling ``register()``, configurations can be listed in the
+    ``SIMPLE_COMMENTS_CONFIGURATIONS`` setting, which maps configuration keys
+    to the dotted path of a comment model, or to a tuple of the dotted paths
+    of a comment model and a configuration class, optionally followed by a
+    database alias. These are only imported once they are first needed::
+
+        SIMPLE_COMMENTS_CONFIGURATIONS = {
+            'article': ('articles.models.ArticleComment',
+                        'articles.models.ArticleCommentConfiguration'),
+        }
+
+    """
     
     __shared_state = {
         'configurations': {},
+        'loaded_keys': set(),
+        'lock': threading.RLock(),
     }
     
     def __init__(self):
         self.__dict__ = self.__shared_state
+
+    def load_configurations(self, configuration_key=None):
+        """Register the configurations listed in
+        ``SIMPLE_COMMENTS_CONFIGURATIONS`` that haven't been loaded yet, or
+        only the one matching ``configuration_key`` if given.
+
+        """
+        settings_configurations = getattr(settings,
+                                          'SIMPLE_COMMENTS_CONFIGURATIONS', {})
+        if configuration_key is None:
+            keys = settings_configurations.keys()
+        elif configuration_key in settings_configurations:
+            keys = [configuration_key]
+        else:
+            return
+        keys = [key for key in keys if key not in self.loaded_keys]
+        if not keys:
+            return
+
+        self.lock.acquire()
+        try:
+            for key in keys:
+                if key in self.loaded_keys:
+                    continue
+                value = settings_configurations[key]
+                if isinstance(value, basestring):
+                    value = (value,)
+                args = [import_object(path) for path in value[:2]]
+                args.extend(value[2:])
+                if key not in self.configurations:
+                    self.register(key, *args)
+                self.loaded_keys.add(key)
+        finally:
+            self.lock.release()
+
+    def get_settings_keys(self, model):
+        """Return the keys of ``SIMPLE_COMMENTS_CONFIGURATIONS`` whose
+        comment model is ``model``, without importing anything.
+
+        An entry names ``model`` if its path is the module and name of
+        ``model``, or if it points to an imported module holding ``model``
+        under that name, such as a package re-exporting it.
+
+        """
+        model_path = '%s.%s' % (model.__module__, model.__name__)
+        settings_configurations = getattr(settings,
+                                          'SIMPLE_COMMENTS_CONFIGURATIONS', {})
+        keys = []
+        for (key, value) in settings_configurations.items():
+            if isinstance(value, basestring):
+                value = (value,)
+            path = value[0]
+            if path == model_path:
+                keys.append(key)
+                continue
+            if '.' not in path:
+                continue
+            (module_name, name) = path.rsplit('.', 1)
+            module = sys.modules.get(module_name)
+            if module is not None and getattr(module, name, None) is model:
+                keys.append(key)
+        return keys
+
+    def autodiscover(self):
+        """Import the ``comments`` module of every installed app, if it
+        exists, so that configurations registered there are available.
+
+        """
+        for app in settings.INSTALLED_APPS:
+            try:
+                app_path = import_module(app).__path__
+            except AttributeError:
+                continue
+            try:
+                imp.find_module('comments', app_path)
+            except ImportError:
+                continue
+            import_module('%s.comments' % app)
     
     def register(self, configuration_key, comment_model,
-                 configuration_class=CommentConfiguration):
+                 configuration_class=CommentConfiguration, database=None):
         """Register ``comment_model`` and ``configuration_class`` against
         ``configuration_key``. If configuration class is not given the default
         ``CommentConfiguration`` will be used.
+
+        ``database`` is an optional database alias, or a function mapping the
+        primary key of a target to an alias, that comments will be stored in.
         
         """
         try:
@@ -368,7 +1283,7 @@ class CommentConfigurations(object):
             raise CommentConfigurationAlreadyRegistered
         except KeyError:
             configuration = configuration_class(configuration_key,
-                                                comment_model)
+                                                comment_model, database)
             self.configurations[configuration_key] = configuration
     
     def unregister(self, configuration_key):
@@ -383,18 +1298,56 @@ class CommentConfigurations(object):
         ``configuration_key``.
         
         """
+        if configuration_key not in self.configurations:
+            self.load_configurations(configuration_key)
         try:
             return self.configurations[configuration_key]
         except KeyError:
             raise CommentConfigurationNotRegistered
 
+    def get_configuration_for_model(self, model):
+        """Return the configuration using ``model`` either as its comment
+        model or as its archive model, or ``None``. If several do, the one
+        with the first key in sorted order is returned.
+
+        This is called by the router and on every comment save, so it
+        doesn't load all of ``SIMPLE_COMMENTS_CONFIGURATIONS``. Only the
+        entries returned by ``get_settings_keys()`` are loaded. Archive
+        models are matched against configurations that are already loaded,
+        which is always the case when archiving.
+
+        """
+        for key in self.get_settings_keys(model):
+            if key not in self.loaded_keys:
+                self.load_configurations(key)
+        items = self.configurations.items()
+        items.sort()
+        for (key, configuration) in items:
+            if model in (configuration.model, configuration.archive_model):
+                return configuration
+        return None
+
     def all_configurations(self):
+        self.load_configurations()
         return self.configurations.items()
 
+    def sync_user_fields(self, user, batch_size=500):
+        """Update the denormalized user fields of comments by ``user`` for
+        all registered configurations. Return the number of updated comments.
+
+        """
+        updated = 0
+        for (key, configuration) in self.all_configurations():
+            updated += configuration.sync_user_fields(user, batch_size)
+        return updated
+
 
 configurations = CommentConfigurations()
 
 all_configurations= configurations.all_configurations
+get_configuration_for_model = configurations.get_configuration_for_model
+sync_user_fields = configurations.sync_user_fields
 register = configurations.register
 unregister = configurations.unregister
 get_configuration = configurations.get_configuration
+autodiscover = configurations.autodiscover
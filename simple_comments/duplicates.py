@@ -0,0 +1,191 @@
+import re
+import time
+import zlib
+import random
+import threading
+
+from django.conf import settings
+
+NUM_PERMUTATIONS = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_PERMUTATIONS',
+                           32)
+NUM_BANDS = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_BANDS', 8)
+SHINGLE_SIZE = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_SHINGLE_SIZE', 3)
+MIN_SHINGLES = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_MIN_SHINGLES', 5)
+MAX_SHINGLES = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_MAX_SHINGLES', 32)
+MAX_WORDS = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_MAX_WORDS', 100)
+MAX_ENTRIES = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_MAX_ENTRIES', 10000)
+MAX_AGE = getattr(settings, 'SIMPLE_COMMENTS_MINHASH_MAX_AGE', 60 * 60)
+
+# A Mersenne prime larger than any 32 bit shingle hash.
+PRIME = (1 << 61) - 1
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def shingles(text, size=SHINGLE_SIZE, max_words=MAX_WORDS,
+             max_shingles=MAX_SHINGLES):
+    """Return the set of hashed word shingles of length ``size`` found in
+    the first ``max_words`` words of ``text``.
+
+    To bound the cost of a signature only the ``max_shingles`` smallest
+    hashes are kept. As the same hash function is used for every text this
+    is a consistent sample, so similar texts keep similar shingles.
+
+    """
+    # Avoid running the regular expression over huge bodies.
+    words = WORD_RE.findall(text[:max_words * 20].lower())[:max_words]
+    result = set()
+    for i in range(len(words) - size + 1):
+        shingle = u' '.join(words[i:i + size]).encode('utf-8')
+        result.add(zlib.crc32(shingle) & 0xffffffff)
+    return set(sorted(result)[:max_shingles])
+
+
+class MinHashIndex(object):
+    """Bounded, time-evicted in-memory index of MinHash signatures.
+
+    Signatures are split into ``num_bands`` bands that are used as
+    locality-sensitive hash buckets, so a lookup only compares the query
+    against entries sharing at least one band instead of every entry in the
+    index. Entries older than ``max_age`` seconds are evicted, as is the
+    oldest entry whenever the index grows beyond ``max_entries``.
+
+    Texts with fewer than ``MIN_SHINGLES`` shingles, such as a simple
+    "Thanks!", are too short to tell spam from coincidence. They are neither
+    indexed nor matched.
+
+    The index lives in process memory and is safe to use from multiple
+    threads.
+
+    """
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, num_bands=NUM_BANDS,
+                 max_entries=MAX_ENTRIES, max_age=MAX_AGE, seed=1):
+        if num_permutations % num_bands:
+            raise ValueError(u"num_permutations must be a multiple of "
+                             u"num_bands")
+        self.num_permutations = num_permutations
+        self.num_bands = num_bands
+        self.rows = num_permutations / num_bands
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+        rng = random.Random(seed)
+        self.permutations = [(rng.randint(1, PRIME - 1),
+                              rng.randint(0, PRIME - 1)) \
+                             for i in range(num_permutations)]
+
+        self.lock = threading.Lock()
+        self.counter = 0
+        # Entries are kept in insertion order, which is also the order in
+        # which they expire.
+        self.order = []
+        self.entries = {}
+        self.buckets = {}
+
+    def signature(self, text):
+        """Return the MinHash signature of ``text`` as a tuple, or ``None``
+        if ``text`` is too short.
+
+        """
+        hashes = shingles(text)
+        if len(hashes) < MIN_SHINGLES:
+            return None
+        return tuple([min([(a * h + b) % PRIME for h in hashes]) \
+                      for (a, b) in self.permutations])
+
+    def bands(self, signature):
+        rows = self.rows
+        return [(i, signature[i * rows:(i + 1) * rows]) \
+                for i in range(self.num_bands)]
+
+    def similarity(self, a, b):
+        """Return the estimated Jaccard similarity of two signatures."""
+        matches = len([1 for (x, y) in zip(a, b) if x == y])
+        return float(matches) / self.num_permutations
+
+    def add(self, text, value=None):
+        """Add ``text`` to the index, optionally associating ``value`` with
+        it.
+
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self.counter += 1
+            entry_id = self.counter
+            self.entries[entry_id] = (now, signature, value)
+            self.order.append(entry_id)
+            for band in self.bands(signature):
+                self.buckets.setdefault(band, set()).add(entry_id)
+            self._evict(now)
+        finally:
+            self.lock.release()
+
+    def query(self, text, threshold):
+        """Return ``(similarity, value)`` for the most similar live entry
+        whose estimated similarity to ``text`` is at least ``threshold``, or
+        ``None`` if no such entry exists.
+
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self._evict(now)
+            candidates = set()
+            for band in self.bands(signature):
+                candidates.update(self.buckets.get(band, ()))
+            best = None
+            for entry_id in candidates:
+                (added, other, value) = self.entries[entry_id]
+                similarity = self.similarity(signature, other)
+                if similarity >= threshold and \
+                   (best is None or similarity > best[0]):
+                    best = (similarity, value)
+            return best
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.order = []
+            self.entries = {}
+            self.buckets = {}
+        finally:
+            self.lock.release()
+
+    def _evict(self, now):
+        """Drop expired entries and trim the index to ``max_entries``. The
+        caller must hold the lock.
+
+        """
+        expired = 0
+        cutoff = now - self.max_age
+        for entry_id in self.order:
+            if self.entries[entry_id][0] >= cutoff and \
+               len(self.order) - expired <= self.max_entries:
+                break
+            expired += 1
+        if not expired:
+            return
+        for entry_id in self.order[:expired]:
+            (added, signature, value) = self.entries.pop(entry_id)
+            for band in self.bands(signature):
+                bucket = self.buckets[band]
+                bucket.discard(entry_id)
+                if not bucket:
+                    del(self.buckets[band])
+        del(self.order[:expired])
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# The index is shared by all configurations so that spam waves spread over
+# several comment models are caught as well.
+index = MinHashIndex()
@@ -0,0 +1,140 @@
+import atexit
+import logging
+import threading
+
+from django.db import connections
+
+logger = logging.getLogger('simple_comments')
+
+class IngestBuffer(object):
+    """In-process write-behind buffer of validated comments awaiting
+    persistence.
+
+    Comments are handed to ``configuration.persist_comments()`` once
+    ``ingest_batch_size`` comments have been buffered, or
+    ``ingest_flush_interval`` milliseconds after the first comment of a batch
+    was buffered, whichever happens first. Remaining comments are flushed
+    when the process exits.
+
+    Comments that fail to save are put back at the front of the buffer and
+    retried with the next flush. After ``ingest_max_attempts`` failures they
+    are logged and dropped.
+
+    """
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.batch_size = configuration.ingest_batch_size
+        self.flush_interval = configuration.ingest_flush_interval / 1000.0
+        self.max_attempts = configuration.ingest_max_attempts
+        self.lock = threading.Lock()
+        self.comments = []
+        self.timer = None
+        atexit.register(self.flush_at_exit)
+
+    def add(self, comment):
+        """Buffer ``comment``, flushing the buffer if it is full."""
+        batch = None
+        self.lock.acquire()
+        try:
+            self.comments.append(comment)
+            if len(self.comments) >= self.batch_size:
+                batch = self.take()
+            else:
+                self.schedule()
+        finally:
+            self.lock.release()
+        if batch:
+            self.persist(batch)
+
+    def schedule(self):
+        """Start the flush timer unless it is running. The caller must hold
+        the lock.
+
+        """
+        if self.timer is None:
+            self.timer = threading.Timer(self.flush_interval,
+                                         self.flush_in_background)
+            self.timer.setDaemon(True)
+            self.timer.start()
+
+    def take(self):
+        """Empty the buffer and return its comments. The caller must hold
+        the lock.
+
+        """
+        batch = self.comments
+        self.comments = []
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    def flush(self):
+        """Persist all buffered comments and return how many there were."""
+        self.lock.acquire()
+        try:
+            batch = self.take()
+        finally:
+            self.lock.release()
+        if batch:
+            self.persist(batch)
+        return len(batch)
+
+    def persist(self, batch):
+        """Save ``batch`` and put the comments that failed to save back at
+        the front of the buffer.
+
+        """
+        failed = self.configuration.persist_comments(batch)
+        retry = []
+        for comment in failed:
+            comment._ingest_attempts = getattr(comment, '_ingest_attempts',
+                                               0) + 1
+            if comment._ingest_attempts < self.max_attempts:
+                retry.append(comment)
+            else:
+                logger.error("Dropped buffered comment by '%s' on target %s "
+                             "after %d failed attempts: %r" % \
+                             (comment.author_name, comment.target_id,
+                              comment._ingest_attempts, comment.body))
+        if retry:
+            self.lock.acquire()
+            try:
+                self.comments[:0] = retry
+                self.schedule()
+            finally:
+                self.lock.release()
+
+    def flush_at_exit(self):
+        # Retry failed comments right away, as no timer will fire anymore.
+        while self.flush():
+            pass
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # Connections are per thread, so don't leave this one open.
+            for connection in connections.all():
+                connection.close()
+
+    def get_duplicate(self, comment):
+        """Return a buffered comment by the same author, on the same target
+        and day with the same body as ``comment``, or ``None``.
+
+        """
+        fields = ('user_id', 'author_name', 'author_email', 'author_website',
+                  'target_id', 'body')
+        self.lock.acquire()
+        try:
+            for other in reversed(self.comments):
+                if other.pub_date.date() == comment.pub_date.date() and \
+                   [getattr(other, f) for f in fields] == \
+                   [getattr(comment, f) for f in fields]:
+                    return other
+        finally:
+            self.lock.release()
+        return None
+
+    def __len__(self):
+        return len(self.comments)
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.utils.translation import ugettext_noop as _
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import signals
+
+# Create tables for the notification-app if available. The app is only
+# imported once syncdb runs, to keep importing this module cheap.
+
+def create_notice_types(app, created_models, verbosity, **kwargs):
+    if "notification" not in settings.INSTALLED_APPS or \
+       app.__name__ != 'notification.models':
+        return
+
+    from notification import models as notification
+    from simple_comments import comments
+
+    notification.create_notice_type(comments.NOTIFICATION_LABEL,
+                                    _("Comment"), _("someone has "
+                                                    "commented"))
+
+signals.post_syncdb.connect(create_notice_types)
+
+# Index the queries on the ``status`` column. An index on ``status`` alone is
+# useless for them, as the column only holds three values:
+#
+# * displaying comments, ``WHERE target_id = ? AND status = PUBLIC ORDER BY
+#   pub_date``,
+# * the moderation queue, ``WHERE status = PENDING ORDER BY id``.
+
+def supports_partial_indexes(connection):
+    engine = connection.settings_dict['ENGINE']
+    if 'postgresql' in engine:
+        return True
+    if 'sqlite' in engine:
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 8, 0)
+    return False
+
+def index_exists(connection, cursor, table, name):
+    engine = connection.settings_dict['ENGINE']
+    if 'postgresql' in engine:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND "
+                       "indexname = %s", [table, name])
+    elif 'sqlite' in engine:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND "
+                       "tbl_name = %s AND name = %s", [table, name])
+    elif 'mysql' in engine:
+        cursor.execute("SHOW INDEX FROM %s WHERE Key_name = %%s" % \
+                       connection.ops.quote_name(table), [name])
+    else:
+        return False
+    return bool(cursor.fetchall())
+
+def get_comment_indexes(model, connection):
+    """Return ``(name, sql)`` tuples of the indexes to create for the comment
+    model ``model``.
+
+    """
+    from simple_comments.models import BaseComment
+
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    pk = qn(opts.pk.column)
+    target = qn(opts.get_field('target').column)
+    pub_date = qn(opts.get_field('pub_date').column)
+    status = qn(opts.get_field('status').column)
+    if supports_partial_indexes(connection):
+        indexes = (
+            ('public', '%s, %s' % (target, pub_date), BaseComment.PUBLIC),
+            ('pending', pk, BaseComment.PENDING),
+        )
+        sql = 'CREATE INDEX %s ON %s (%s) WHERE ' + status + ' = %d'
+    else:
+        indexes = (
+            ('public', '%s, %s, %s' % (target, status, pub_date), None),
+            ('pending', '%s, %s' % (status, pk), None),
+        )
+        sql = 'CREATE INDEX %s ON %s (%s)'
+    result = []
+    for (suffix, columns, value) in indexes:
+        name = '%s_%s' % (opts.db_table, suffix)
+        name = name[:connection.ops.max_name_length()]
+        params = (qn(name), table, columns)
+        if value is not None:
+            params += (value,)
+        result.append((name, sql % params))
+    return result
+
+def create_comment_indexes(app, created_models, verbosity, **kwargs):
+    from django.db.models import get_models
+    from simple_comments.models import BaseComment
+
+    database = kwargs.get('db', DEFAULT_DB_ALIAS)
+    connection = connections[database]
+    cursor = None
+    # The signal is sent once for every app, with the models created for all
+    # of them, and again by ``flush``.
+    for model in get_models(app):
+        if model not in created_models or not issubclass(model, BaseComment):
+            continue
+        if cursor is None:
+            cursor = connection.cursor()
+        for (name, sql) in get_comment_indexes(model, connection):
+            if index_exists(connection, cursor, model._meta.db_table, name):
+                continue
+            if verbosity >= 2:
+                print "Creating index %s for %s model" % \
+                      (name, model._meta.object_name)
+            cursor.execute(sql)
+    if cursor is not None:
+        transaction.commit_unless_managed(using=database)
+
+signals.post_syncdb.connect(create_comment_indexes)
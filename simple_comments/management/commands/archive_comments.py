@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_comments import comments
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=None,
+                    help='Number of comments to move per transaction.'),
+    )
+    help = ("Move old comments on closed targets to the archive model of "
+            "their configuration.")
+    args = '[configuration_key ...]'
+
+    def handle(self, *configuration_keys, **options):
+        try:
+            if configuration_keys:
+                configurations = [comments.get_configuration(key) for \
+                                  key in configuration_keys]
+            else:
+                configurations = [c for (key, c) in \
+                                  comments.all_configurations()]
+        except comments.CommentConfigurationNotRegistered:
+            raise CommandError("Unknown configuration key")
+
+        verbosity = int(options.get('verbosity', 1))
+        for configuration in configurations:
+            if configuration.archive_model is None:
+                continue
+            try:
+                archived = configuration.archive_comments(
+                    options['batch_size'])
+            except comments.CommentCopyConflict, e:
+                raise CommandError(unicode(e))
+            if verbosity > 0:
+                print "Archived %d comments for '%s'" % \
+                      (archived, configuration.configuration_key)
@@ -0,0 +1,59 @@
+import os
+import pstats
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_comments import profiling
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', dest='limit', type='int', default=20,
+                    help='Number of profiles or functions to show.'),
+        make_option('--sort', dest='sort', default='cumulative',
+                    help='pstats sort key used when showing a profile.'),
+        make_option('--clear', dest='clear', action='store_true',
+                    default=False, help='Delete all stored profiles.'),
+    )
+    help = ("List the profiles stored by the simple_comments profiling "
+            "middleware, or show the statistics and queries of one.")
+    args = '[profile_id]'
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            for profile in profiling.load_profiles():
+                for extension in ('json', 'prof'):
+                    path = os.path.join(profiling.PROFILE_DIR, '%s.%s' % \
+                                        (profile['id'], extension))
+                    if os.path.exists(path):
+                        os.remove(path)
+            return
+
+        profiles = profiling.load_profiles()
+        if not args:
+            for profile in profiles[:options['limit']]:
+                query_time = sum([q['duration'] for q in profile['queries']])
+                print "%s  %s %s  %.1fms  %d queries (%.1fms)" % \
+                      (profile['id'], profile['method'], profile['path'],
+                       profile['duration'], len(profile['queries']),
+                       query_time)
+            return
+
+        matching = [p for p in profiles if p['id'] == args[0]]
+        if not matching:
+            raise CommandError("No profile with id '%s'" % args[0])
+        profile = matching[0]
+
+        stats_path = os.path.join(profiling.PROFILE_DIR,
+                                  '%s.prof' % profile['id'])
+        stats = pstats.Stats(stats_path)
+        stats.sort_stats(options['sort']).print_stats(options['limit'])
+
+        for query in profile['queries']:
+            print "%.1fms [%s] %s" % (query['duration'], query['database'],
+                                      query['origin'])
+            print "    %s" % query['sql']
+            if query['params']:
+                print "    params: %s" % ', '.join(query['params'])
+            for line in query.get('plan', []):
+                print "    plan: %s" % line
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_comments import comments
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of comments to move per transaction.'),
+    )
+    help = ("Move the comments of a configuration from one database to "
+            "another. Update the database of the configuration before "
+            "running this command when sharding by function.")
+    args = 'configuration_key from_database to_database'
+
+    def handle(self, *args, **options):
+        if len(args) != 3:
+            raise CommandError("Usage: rebalance_comments %s" % self.args)
+        (configuration_key, from_database, to_database) = args
+        try:
+            configuration = comments.get_configuration(configuration_key)
+        except comments.CommentConfigurationNotRegistered:
+            raise CommandError("Unknown configuration key '%s'" % \
+                               configuration_key)
+
+        try:
+            moved = configuration.rebalance_comments(from_database,
+                                                     to_database,
+                                                     options['batch_size'])
+        except comments.CommentCopyConflict, e:
+            raise CommandError(unicode(e))
+        if int(options.get('verbosity', 1)) > 0:
+            print "Moved %d comments from '%s' to '%s'" % \
+                  (moved, from_database, to_database)
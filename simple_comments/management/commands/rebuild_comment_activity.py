@@ -0,0 +1,73 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from simple_comments import comments
+from simple_comments.models import UserCommentActivity
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of comments to index per transaction.'),
+    )
+    help = ("Rebuild the per-user comment activity index of the given "
+            "configurations, or of all of them.")
+    args = '[configuration_key ...]'
+
+    def handle(self, *configuration_keys, **options):
+        try:
+            if configuration_keys:
+                configurations = [comments.get_configuration(key) for \
+                                  key in configuration_keys]
+            else:
+                configurations = [c for (key, c) in \
+                                  comments.all_configurations()]
+        except comments.CommentConfigurationNotRegistered:
+            raise CommandError("Unknown configuration key")
+
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        for configuration in configurations:
+            key = configuration.configuration_key
+            owner = comments.get_configuration_for_model(configuration.model)
+            UserCommentActivity.objects.filter(configuration_key=key).delete()
+            if owner is not configuration:
+                # The comments are indexed under the key of another
+                # configuration using the same model. Entries left from
+                # before it was registered have been removed.
+                if verbosity > 0:
+                    print "Skipped '%s', its comments are indexed as '%s'" % \
+                          (key, owner.configuration_key)
+                continue
+            models = [(configuration.model, False)]
+            if configuration.archive_model is not None:
+                models.append((configuration.archive_model, True))
+            indexed = 0
+            for database in configuration.get_databases():
+                for (model, archived) in models:
+                    queryset = model._default_manager.using(database)
+                    queryset = queryset.filter(user__isnull=False)
+                    queryset = queryset.order_by('pk')
+                    queryset = queryset.values_list('pk', 'user', 'target',
+                                                    'pub_date')
+                    last_pk = 0
+                    while True:
+                        rows = queryset.filter(pk__gt=last_pk)
+                        rows = list(rows[:batch_size])
+                        if not rows:
+                            break
+                        last_pk = rows[-1][0]
+                        self.index_rows(key, database, archived, rows)
+                        indexed += len(rows)
+            if verbosity > 0:
+                print "Indexed %d comments for '%s'" % (indexed, key)
+
+    def index_rows(self, configuration_key, database, archived, rows):
+        for (pk, user_id, target_id, pub_date) in rows:
+            UserCommentActivity.objects.create(
+                user_id=user_id, configuration_key=configuration_key,
+                database=database, archived=archived, comment_id=pk,
+                target_id=target_id, pub_date=pub_date)
+    index_rows = transaction.commit_on_success(index_rows)
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from simple_comments import comments
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of users to load and comments to update '
+                         'at a time.'),
+    )
+    help = ("Copy the current name, email and username of users onto the "
+            "comments they have posted.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = set()
+        for (key, configuration) in comments.all_configurations():
+            for database in configuration.get_databases():
+                queryset = configuration.model._default_manager.using(database)
+                queryset = queryset.filter(user__isnull=False).order_by()
+                user_ids.update(queryset.values_list('user', flat=True) \
+                                        .distinct())
+
+        user_ids = sorted(user_ids)
+        updated = 0
+        for i in range(0, len(user_ids), batch_size):
+            users = User.objects.filter(pk__in=user_ids[i:i + batch_size])
+            for user in users:
+                updated += comments.sync_user_fields(user, batch_size)
+
+        if int(options.get('verbosity', 1)) > 0:
+            print "Updated %d comments" % updated
@@ -2,9 +2,19 @@ import datetime
 
 from django.conf import settings
 from django.db import models
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import signals, Count
 from django.contrib.auth.models import User
 
 BODY_MAX_LENGTH = getattr(settings, 'SIMPLE_COMMENTS_BODY_MAX_LENGTH', 3000)
+SYNC_USER_FIELDS = getattr(settings, 'SIMPLE_COMMENTS_SYNC_USER_FIELDS', False)
+
+class PublicCommentManager(models.Manager):
+    """Manager limited to comments that have been approved for display."""
+    def get_query_set(self):
+        queryset = super(PublicCommentManager, self).get_query_set()
+        return queryset.filter(status=BaseComment.PUBLIC)
+
 
 class BaseComment(models.Model):
     """Abstract base class used to create comment models.
@@ -17,8 +27,21 @@ class BaseComment(models.Model):
     ``author_name`` and ``author_email``. If a ``User`` instance is supplied
     these fields will be retrieved from that instance. Data retrieved from a
     supplied user will always take precedence.
+
+    Comments awaiting moderation or rejected by a moderator have a ``status``
+    other than ``PUBLIC``. The ``public`` manager only returns public
+    comments and is used wherever comments are displayed. ``syncdb`` adds an
+    index on ``(target_id, pub_date)`` restricted to public comments and one
+    on ``id`` restricted to pending comments on PostgreSQL and SQLite, so
+    display queries and the moderation queue never touch other rows. Other
+    databases get indexes on ``(target_id, status, pub_date)`` and
+    ``(status, id)`` instead. See the README for upgrading existing tables.
     
     """
+    (PENDING, PUBLIC, REJECTED) = (0, 1, 2)
+    STATUS_CHOICES = ((PENDING, u'Pending'), (PUBLIC, u'Public'),
+                      (REJECTED, u'Rejected'))
+
     user = models.ForeignKey(User, null=True, blank=True)
     # Store the username here as a simple act of denormalization. Using
     # convenience methods (such as get_absolute_url) on nullable foreign keys
@@ -32,9 +55,16 @@ class BaseComment(models.Model):
     
     body = models.TextField(max_length=BODY_MAX_LENGTH)
     
-    pub_date = models.DateTimeField(default=datetime.datetime.now)
+    pub_date = models.DateTimeField(default=datetime.datetime.now,
+                                    db_index=True)
     
     ip_address  = models.IPAddressField(blank=True, null=True)
+
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES,
+                                              default=PUBLIC)
+
+    objects = models.Manager()
+    public = PublicCommentManager()
     
     def __init__(self, *args, **kwargs):
         """Override to make sure that a ``ForeignKeyField`` named ``target``
@@ -50,25 +80,49 @@ class BaseComment(models.Model):
             raise TypeError(u"Subclasses of BaseComment must add a foreign "
                             u"key field named target")
     
+    @staticmethod
+    def get_denormalized_user_fields(user):
+        """Return a dictionary of the values copied from ``user`` onto
+        comments.
+
+        """
+        if user.first_name or user.last_name:
+            author_name = user.get_full_name()
+        else:
+            # Fall back on the user's username if neither first- nor last
+            # names were set on the user instance.
+            author_name = user.username
+        return {
+            'author_name': author_name,
+            'author_email': user.email,
+            'user_username': user.username,
+        }
+
     def denormalize_user_instance(self):
         """Set the author name, email and username on the model if a ``User``
         instance has been supplied.
         
         """
-        user = self.user
-        if user is not None:
-            if user.first_name or user.last_name:
-                self.author_name = user.get_full_name()
-            else:
-                # Fall back on the user's username if neither first- nor last
-                # names were set on the user instance.
-                self.author_name = user.username
-            self.author_email = user.email
-            self.user_username = user.username
+        if self.user_id is None:
+            return
+        fields = self.get_denormalized_user_fields(self.user)
+        for (name, value) in fields.items():
+            setattr(self, name, value)
+        self._denormalized_user_id = self.user_id
 
     def save(self, *args, **kwargs):
-        self.denormalize_user_instance()
+        # Skip denormalizing if it was just done for the same user, which is
+        # the case when posting through ``CommentConfiguration``.
+        if getattr(self, '_denormalized_user_id', None) != self.user_id:
+            self.denormalize_user_instance()
+        self._denormalized_user_id = None
+        created = self.pk is None
         super(BaseComment, self).save(*args, **kwargs)
+        UserCommentActivity.objects.update_for_comment(self, created)
+
+    def delete(self, *args, **kwargs):
+        UserCommentActivity.objects.delete_for_comment(self)
+        super(BaseComment, self).delete(*args, **kwargs)
     
     @classmethod
     def get_target_model(cls):
@@ -81,3 +135,207 @@ class BaseComment(models.Model):
     class Meta:
         abstract = True
         get_latest_by = 'pub_date'
+
+
+class UserCommentActivityManager(models.Manager):
+    def get_entry_lookup(self, comment):
+        """Return the lookup identifying the entry of ``comment``, or
+        ``None`` if comments of its model aren't indexed. Comments on
+        different shards may share a primary key, and so may a live comment
+        and an archived one, so the database and the model are part of the
+        lookup.
+
+        """
+        from simple_comments import comments
+        configuration = comments.get_configuration_for_model(comment.__class__)
+        if configuration is None:
+            return None
+        return {
+            'configuration_key': configuration.configuration_key,
+            'database': comment._state.db or DEFAULT_DB_ALIAS,
+            'archived': comment.__class__ is configuration.archive_model,
+            'comment_id': comment.pk,
+        }
+
+    def update_for_comment(self, comment, created=False):
+        """Create or update the entry of ``comment``, or remove it if the
+        comment no longer has a user. Comments that were just ``created``
+        can't have an entry yet, so one is inserted for comments by users
+        and the table isn't touched for anonymous ones.
+
+        """
+        if created and comment.user_id is None:
+            return
+        lookup = self.get_entry_lookup(comment)
+        if lookup is None:
+            return
+        if created:
+            self.create(user_id=comment.user_id, target_id=comment.target_id,
+                        pub_date=comment.pub_date, **lookup)
+            return
+        queryset = self.filter(**lookup)
+        if comment.user_id is None:
+            queryset.delete()
+            return
+        if not queryset.update(user=comment.user_id,
+                               target_id=comment.target_id,
+                               pub_date=comment.pub_date):
+            self.create(user_id=comment.user_id, target_id=comment.target_id,
+                        pub_date=comment.pub_date, **lookup)
+
+    def delete_for_comment(self, comment):
+        lookup = self.get_entry_lookup(comment)
+        if lookup is not None:
+            self.filter(**lookup).delete()
+
+    def filter_for_comments(self, model, database, comment_ids):
+        """Return the entries of the comments of ``model`` with the primary
+        keys ``comment_ids`` in ``database``, or ``None`` if comments of
+        ``model`` aren't indexed.
+
+        """
+        from simple_comments import comments
+        configuration = comments.get_configuration_for_model(model)
+        if configuration is None:
+            return None
+        return self.filter(configuration_key=configuration.configuration_key,
+                           database=database,
+                           archived=model is configuration.archive_model,
+                           comment_id__in=comment_ids)
+
+    def delete_for_comments(self, model, database, comment_ids):
+        """Remove the entries of the comments of ``model`` with the primary
+        keys ``comment_ids`` in ``database``, which were deleted without
+        calling ``delete()``.
+
+        """
+        queryset = self.filter_for_comments(model, database, comment_ids)
+        if queryset is not None:
+            queryset.delete()
+
+    def for_user(self, user, configuration_key=None):
+        """Return the entries of ``user``, newest first."""
+        queryset = self.filter(user=user)
+        if configuration_key is not None:
+            queryset = queryset.filter(configuration_key=configuration_key)
+        return queryset.order_by('-pub_date')
+
+    def count_by_configuration(self, user):
+        """Return a dictionary mapping configuration keys to the number of
+        comments ``user`` has posted using them.
+
+        """
+        queryset = self.filter(user=user).values('configuration_key')
+        queryset = queryset.annotate(count=Count('id')).order_by()
+        return dict([(row['configuration_key'], row['count']) \
+                     for row in queryset])
+
+    def owned_comment_ids(self, user, configuration_key, comment_ids,
+                          database=DEFAULT_DB_ALIAS):
+        """Return the set of ``comment_ids`` stored in ``database`` that were
+        posted by ``user`` using ``configuration_key``.
+
+        """
+        queryset = self.filter(user=user, configuration_key=configuration_key,
+                               database=database, archived=False,
+                               comment_id__in=comment_ids)
+        return set(queryset.values_list('comment_id', flat=True))
+
+    def get_comments(self, entries):
+        """Return the public comments referenced by ``entries``, in the
+        same order, using one query per configuration and database. Every
+        comment gets a ``configuration_key`` attribute.
+
+        """
+        from simple_comments import comments
+        entries = list(entries)
+        by_shard = {}
+        for entry in entries:
+            by_shard.setdefault((entry.configuration_key, entry.database,
+                                 entry.archived), []).append(entry.comment_id)
+        found = {}
+        for ((key, database, archived), comment_ids) in by_shard.items():
+            try:
+                configuration = comments.get_configuration(key)
+            except comments.CommentConfigurationNotRegistered:
+                continue
+            if archived:
+                if configuration.archive_model is None:
+                    continue
+                model = configuration.archive_model
+            else:
+                model = configuration.model
+            if len(configuration.get_databases()) > 1:
+                queryset = model.public.using(database)
+            else:
+                # Keep reading from the replica, if there is one.
+                queryset = model.public.using(
+                    configuration.get_read_database())
+            for (pk, comment) in queryset.in_bulk(comment_ids).items():
+                comment.configuration_key = key
+                found[(key, database, archived, pk)] = comment
+        keys = [(e.configuration_key, e.database, e.archived, e.comment_id) \
+                for e in entries]
+        return [found[key] for key in keys if key in found]
+
+
+class UserCommentActivity(models.Model):
+    """Compact index of the comments posted by registered users across all
+    configurations, kept in sync by ``BaseComment.save()`` and
+    ``BaseComment.delete()``. It answers user history and per-user counting
+    queries from a single indexed table instead of one query per comment
+    model.
+
+    Entries are keyed by configuration, database and comment, as comments on
+    different shards may share primary keys. A comment model used by
+    several configurations is indexed under the first of their keys in
+    sorted order, and archive models under the key of their configuration
+    with ``archived`` set. Archived comments keep their primary keys, which
+    some databases hand out again to new live comments.
+
+    Entries are not maintained by bulk operations that bypass ``save()`` and
+    ``delete()``. Run the ``rebuild_comment_activity`` management command
+    after those.
+
+    """
+    user = models.ForeignKey(User, related_name='comment_activity')
+    configuration_key = models.CharField(max_length=100)
+    database = models.CharField(max_length=100, default=DEFAULT_DB_ALIAS)
+    archived = models.BooleanField(default=False)
+    comment_id = models.PositiveIntegerField()
+    target_id = models.PositiveIntegerField()
+    pub_date = models.DateTimeField(db_index=True)
+
+    objects = UserCommentActivityManager()
+
+    class Meta:
+        unique_together = (('configuration_key', 'database', 'archived',
+                            'comment_id'),)
+        verbose_name_plural = 'user comment activity'
+
+
+def remember_user_fields(sender, instance, **kwargs):
+    """Remember the values of a ``User`` that are copied onto comments, so
+    that saves not changing them can be told apart.
+
+    """
+    fields = BaseComment.get_denormalized_user_fields(instance)
+    instance._simple_comments_user_fields = fields
+
+def sync_user_fields(sender, instance, created, **kwargs):
+    """Update the denormalized user fields of comments when the name, email
+    or username of a ``User`` is changed. Other saves, such as the one
+    updating ``last_login``, don't touch the comment tables.
+
+    """
+    fields = BaseComment.get_denormalized_user_fields(instance)
+    previous = getattr(instance, '_simple_comments_user_fields', None)
+    instance._simple_comments_user_fields = fields
+    if created or fields == previous:
+        return
+    from simple_comments import comments
+    comments.sync_user_fields(instance)
+
+if SYNC_USER_FIELDS:
+    signals.post_init.connect(remember_user_fields, sender=User)
+    signals.post_save.connect(sync_user_fields, sender=User)
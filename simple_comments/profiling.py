@@ -0,0 +1,294 @@
+import os
+import time
+import random
+import cProfile
+import tempfile
+import traceback
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils import simplejson
+
+HEADER = getattr(settings, 'SIMPLE_COMMENTS_PROFILING_HEADER',
+                 'HTTP_X_SIMPLE_COMMENTS_PROFILE')
+SAMPLE_RATE = getattr(settings, 'SIMPLE_COMMENTS_PROFILING_SAMPLE_RATE', 0.0)
+SLOW_QUERY = getattr(settings, 'SIMPLE_COMMENTS_PROFILING_SLOW_QUERY', 100)
+PROFILE_DIR = getattr(settings, 'SIMPLE_COMMENTS_PROFILING_DIR',
+                      os.path.join(tempfile.gettempdir(),
+                                   'simple_comments_profiles'))
+MAX_PROFILES = getattr(settings, 'SIMPLE_COMMENTS_PROFILING_MAX_PROFILES', 100)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def get_origin(stack):
+    """Return the frames of ``stack`` that belong to ``simple_comments``,
+    excluding this module, innermost last.
+
+    """
+    this_file = os.path.splitext(os.path.abspath(__file__))[0]
+    frames = []
+    for (filename, lineno, function, line) in stack:
+        path = os.path.abspath(filename)
+        if path.startswith(PACKAGE_DIR) and \
+           os.path.splitext(path)[0] != this_file:
+            frames.append('%s:%s in %s' % (filename, lineno, function))
+    return frames
+
+
+class RecordingCursor(object):
+    """Cursor wrapper timing every query made through it."""
+    def __init__(self, cursor, recorder, alias):
+        self.cursor = cursor
+        self.recorder = recorder
+        self.alias = alias
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.recorder.record(self.alias, sql, params, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.recorder.record(self.alias, sql, None, time.time() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class QueryRecorder(object):
+    """Record the queries made from ``simple_comments`` code on every
+    database connection of the current thread while installed.
+
+    """
+    def __init__(self):
+        self.queries = []
+
+    def install(self):
+        for connection in connections.all():
+            self.wrap(connection)
+
+    def uninstall(self):
+        for connection in connections.all():
+            if 'cursor' in connection.__dict__:
+                del(connection.cursor)
+
+    def wrap(self, connection):
+        cursor = connection.cursor
+        alias = connection.alias
+        def recording_cursor():
+            return RecordingCursor(cursor(), self, alias)
+        connection.cursor = recording_cursor
+
+    def record(self, alias, sql, params, duration):
+        origin = get_origin(traceback.extract_stack())
+        if not origin:
+            return
+        self.queries.append({
+            'database': alias,
+            'sql': sql,
+            'params': params,
+            'duration': duration * 1000,
+            'origin': origin[-1],
+            'stack': origin,
+        })
+
+    def explain_slow_queries(self, threshold=SLOW_QUERY):
+        """Attach the query plan of each ``SELECT`` slower than
+        ``threshold`` milliseconds. Must be called after ``uninstall()``.
+
+        """
+        for query in self.queries:
+            if query['duration'] < threshold or query['params'] is None or \
+               not query['sql'].lstrip().upper().startswith('SELECT'):
+                continue
+            connection = connections[query['database']]
+            if 'sqlite' in connection.settings_dict['ENGINE']:
+                explain = 'EXPLAIN QUERY PLAN '
+            else:
+                explain = 'EXPLAIN '
+            try:
+                cursor = connection.cursor()
+                cursor.execute(explain + query['sql'], query['params'])
+                query['plan'] = [' '.join([unicode(c) for c in row]) \
+                                 for row in cursor.fetchall()]
+            except Exception, e:
+                query['plan'] = [u'Failed to explain query: %s' % e]
+
+
+class Profile(object):
+    """Profiler and query recorder of a single request."""
+    def __init__(self, request):
+        self.request = request
+        self.profiler = cProfile.Profile()
+        self.recorder = QueryRecorder()
+        self.start = time.time()
+        self.finished = False
+        self.recorder.install()
+        self.profiler.enable()
+
+    def finish(self):
+        """Stop profiling and store the profile. Only the first call has any
+        effect.
+
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.profiler.disable()
+        duration = time.time() - self.start
+        self.recorder.uninstall()
+        self.recorder.explain_slow_queries()
+        save_profile(self.request, self.profiler, self.recorder.queries,
+                     duration)
+
+
+class ProfiledContent(object):
+    """Iterator over the content of a streamed response that keeps
+    profiling while the content is generated and stores the profile once it
+    is exhausted or closed.
+
+    """
+    def __init__(self, content, profile):
+        self.content = content
+        self.iterator = iter(content)
+        self.profile = profile
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self.profile.profiler.enable()
+        try:
+            try:
+                return self.iterator.next()
+            except StopIteration:
+                self.close()
+                raise
+        finally:
+            self.profile.profiler.disable()
+
+    def close(self):
+        if hasattr(self.content, 'close'):
+            self.content.close()
+        self.profile.finish()
+
+
+class ProfilingMiddleware(object):
+    """Profile requests and record the queries ``simple_comments`` makes
+    while handling them.
+
+    A request is profiled when it carries the ``X-Simple-Comments-Profile``
+    header and either ``DEBUG`` is on or the user is staff, or when it is
+    picked at random according to ``SIMPLE_COMMENTS_PROFILING_SAMPLE_RATE``.
+    The cProfile statistics and the recorded queries, with plans for queries
+    slower than ``SIMPLE_COMMENTS_PROFILING_SLOW_QUERY`` milliseconds, are
+    stored in ``SIMPLE_COMMENTS_PROFILING_DIR``, which only its owner may
+    read, as queries include their parameters. Only the newest
+    ``SIMPLE_COMMENTS_PROFILING_MAX_PROFILES`` profiles are kept. Use the
+    ``comment_profiles`` management command to inspect them.
+
+    The middleware doesn't call the view itself, so the ``process_view`` and
+    ``process_exception`` methods of other middleware run as usual. The
+    profile of a streamed response is stored once its content has been
+    consumed.
+
+    """
+    def should_profile(self, request):
+        if HEADER in request.META:
+            user = getattr(request, 'user', None)
+            if settings.DEBUG or (user is not None and user.is_staff):
+                return True
+        return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    def process_request(self, request):
+        if self.should_profile(request):
+            request._simple_comments_profile = Profile(request)
+        return None
+
+    def process_exception(self, request, exception):
+        # Don't profile the handling of the exception. The profile is stored
+        # when the error response passes ``process_response``.
+        profile = getattr(request, '_simple_comments_profile', None)
+        if profile is not None:
+            profile.profiler.disable()
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_simple_comments_profile', None)
+        if profile is None or profile.finished:
+            return response
+        if isinstance(response, HttpResponse) and not response._is_string:
+            profile.profiler.disable()
+            response._container = ProfiledContent(response._container,
+                                                  profile)
+        else:
+            profile.finish()
+        return response
+
+
+def save_profile(request, profiler, queries, duration):
+    """Store the statistics of ``profiler`` and ``queries`` in
+    ``PROFILE_DIR``, removing the oldest profiles beyond ``MAX_PROFILES``.
+    Return the id of the profile.
+
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR, 0700)
+    profile_id = '%d-%06x' % (time.time() * 1000, random.getrandbits(24))
+    profiler.dump_stats(os.path.join(PROFILE_DIR, '%s.prof' % profile_id))
+    for query in queries:
+        if query['params'] is not None:
+            query['params'] = [repr(p) for p in query['params']]
+    data = {
+        'id': profile_id,
+        'path': request.path,
+        'method': request.method,
+        'time': time.time(),
+        'duration': duration * 1000,
+        'queries': queries,
+    }
+    f = open(os.path.join(PROFILE_DIR, '%s.json' % profile_id), 'w')
+    try:
+        simplejson.dump(data, f, indent=2)
+    finally:
+        f.close()
+    remove_old_profiles(MAX_PROFILES)
+    return profile_id
+
+def remove_old_profiles(count):
+    """Remove all but the newest ``count`` profiles."""
+    profile_ids = [os.path.splitext(filename)[0] for filename in \
+                   os.listdir(PROFILE_DIR) if filename.endswith('.json')]
+    # Ids start with the time the profile was stored in milliseconds.
+    profile_ids.sort(key=lambda profile_id: int(profile_id.split('-')[0]))
+    for profile_id in profile_ids[:max(len(profile_ids) - count, 0)]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except OSError:
+                # Removed by another process storing a profile.
+                pass
+
+def load_profiles():
+    """Return a list of stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in os.listdir(PROFILE_DIR):
+        if filename.endswith('.json'):
+            f = open(os.path.join(PROFILE_DIR, filename))
+            try:
+                profiles.append(simplejson.load(f))
+            finally:
+                f.close()
+    profiles.sort(key=lambda p: p['time'], reverse=True)
+    return profiles
@@ -0,0 +1,137 @@
+import heapq
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from simple_comments import comments
+
+CACHE_TIMEOUT = getattr(settings, 'SIMPLE_COMMENTS_RECENT_CACHE_TIMEOUT', 60)
+
+DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+def get_cursor(comment):
+    """Return a cursor pointing just past ``comment``, which must be one of
+    the comments returned by ``get_recent_comments()``.
+
+    """
+    return '%s:%s:%s' % (comment.pub_date.strftime(DATE_FORMAT),
+                         comment.configuration_key, comment.pk)
+
+def parse_cursor(cursor):
+    """Return a ``(pub_date, configuration_key, pk)`` tuple from ``cursor``.
+    Raise ``ValueError`` if the cursor is malformed.
+
+    """
+    (pub_date, configuration_key, pk) = cursor.split(':')
+    pub_date = datetime.datetime.strptime(pub_date, DATE_FORMAT)
+    return (pub_date, configuration_key, int(pk))
+
+def get_querysets(configuration):
+    """Return a list of querysets covering all comments of
+    ``configuration``, one per database.
+
+    """
+    if callable(configuration.database):
+        manager = configuration.model.public
+        return [manager.using(database) for \
+                database in configuration.shard_databases]
+    return [configuration.get_queryset()]
+
+def filter_after_cursor(queryset, configuration_key, cursor):
+    """Limit ``queryset`` to comments that sort after ``cursor``. Comments
+    are ordered by descending publication date, configuration key and primary
+    key.
+
+    """
+    (pub_date, cursor_key, cursor_pk) = cursor
+    if configuration_key < cursor_key:
+        return queryset.filter(pub_date__lte=pub_date)
+    if configuration_key > cursor_key:
+        return queryset.filter(pub_date__lt=pub_date)
+    return queryset.filter(Q(pub_date__lt=pub_date) | \
+                           Q(pub_date=pub_date, pk__lt=cursor_pk))
+
+def merge(streams):
+    """Lazily merge iterables of comments that are each sorted by descending
+    publication date, configuration key and primary key into a single
+    sorted iterable.
+
+    """
+    keys = sorted(set([key for (key, stream) in streams]))
+    ranks = dict([(key, rank) for (rank, key) in enumerate(keys)])
+
+    def sort_key(comment):
+        return (-int(comment.pub_date.strftime(DATE_FORMAT)),
+                -ranks[comment.configuration_key], -comment.pk)
+
+    heap = []
+    iterators = []
+    for (index, (key, stream)) in enumerate(streams):
+        iterator = iter(stream)
+        iterators.append((key, iterator))
+        for comment in iterator:
+            comment.configuration_key = key
+            heap.append((sort_key(comment), index, comment))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        (ignored, index, comment) = heapq.heappop(heap)
+        yield comment
+        (key, iterator) = iterators[index]
+        for comment in iterator:
+            comment.configuration_key = key
+            heapq.heappush(heap, (sort_key(comment), index, comment))
+            break
+
+def get_recent_comments(limit=10, cursor=None, user=None):
+    """Return a list of the ``limit`` latest comments across all registered
+    configurations, optionally limited to comments posted by ``user``. Pass
+    the cursor of the last comment of a page (see ``get_cursor()``) to get
+    the next page.
+
+    Each comment model is asked for at most ``limit`` comments per database
+    using an indexed query, and the results are merged. Every comment gets a
+    ``configuration_key`` attribute. The first page is cached for
+    ``SIMPLE_COMMENTS_RECENT_CACHE_TIMEOUT`` seconds.
+
+    """
+    cache_key = None
+    if cursor is None:
+        cache_key = 'simple_comments_recent:%s:%s' % \
+                    (limit, user is not None and user.pk or '')
+        result = cache.get(cache_key)
+        if result is not None:
+            return result
+    else:
+        cursor = parse_cursor(cursor)
+
+    streams = []
+    # A comment model used by several configurations is only read once per
+    # database, for the first of their keys, as in the activity index.
+    seen = set()
+    configurations = comments.all_configurations()
+    configurations.sort()
+    for (key, configuration) in configurations:
+        for queryset in get_querysets(configuration):
+            if (configuration.model, queryset.db) in seen:
+                continue
+            seen.add((configuration.model, queryset.db))
+            queryset = queryset.order_by('-pub_date', '-pk')
+            if user is not None:
+                queryset = queryset.filter(user=user)
+            if cursor is not None:
+                queryset = filter_after_cursor(queryset, key, cursor)
+            streams.append((key, queryset[:limit]))
+
+    result = []
+    for comment in merge(streams):
+        if len(result) == limit:
+            break
+        result.append(comment)
+
+    if cache_key is not None:
+        cache.set(cache_key, result, CACHE_TIMEOUT)
+    return result
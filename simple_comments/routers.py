@@ -0,0 +1,66 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from simple_comments import comments
+
+class CommentRouter(object):
+    """Database router sending reads of registered comment models to the
+    ``read_database`` of their configuration and writes to its
+    ``write_database``, or to their shard when the configuration has a
+    ``database``. Models that aren't registered are left to other routers.
+
+    Objects related to comments on a shard, such as targets and users, are
+    read from the default database rather than from the shard.
+
+    Example::
+
+        DATABASE_ROUTERS = ['simple_comments.routers.CommentRouter']
+
+    """
+    def get_sharded_configuration(self, instance):
+        if instance is None:
+            return None
+        configuration = comments.get_configuration_for_model(
+            instance.__class__)
+        if configuration is None or configuration.database is None:
+            return None
+        return configuration
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        configuration = comments.get_configuration_for_model(model)
+        if configuration is None:
+            if self.get_sharded_configuration(instance) is not None:
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None and callable(configuration.database):
+            return instance._state.db
+        return configuration.get_read_database()
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        configuration = comments.get_configuration_for_model(model)
+        if configuration is None:
+            return None
+        shard = configuration.get_shard_database(
+            getattr(instance, 'target_id', None))
+        if shard is not None:
+            return shard
+        return configuration.write_database
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between comments and their targets and users
+        across databases.
+
+        """
+        for (obj, other) in ((obj1, obj2), (obj2, obj1)):
+            configuration = comments.get_configuration_for_model(
+                obj.__class__)
+            if configuration is None:
+                continue
+            related_models = [f.rel.to for f in obj._meta.fields if f.rel]
+            if other.__class__ in related_models:
+                return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        return None
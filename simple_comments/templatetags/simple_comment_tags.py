@@ -1,6 +1,7 @@
 from django import template
 
 from simple_comments import comments
+from simple_comments import recent
 
 register = template.Library()
 
@@ -44,9 +45,7 @@ class ContextInsertingNode(template.Node):
 
 class CommentListNode(ContextInsertingNode):
     def get_data(self, context, configuration, target):
-        queryset = configuration.model._default_manager.filter(target=target)
-        queryset = queryset.order_by(configuration.order_by)
-        return queryset
+        return configuration.get_queryset(context.get('request'), target)
 
 
 class CommentFormNode(ContextInsertingNode):
@@ -64,6 +63,22 @@ class ConfigurationNode(ContextInsertingNode):
     def get_data(self, context, configuration, target):
         return configuration
 
+class RecentCommentsNode(template.Node):
+    def __init__(self, limit, user, context_variable_name):
+        self.limit = template.Variable(limit)
+        self.user = user and template.Variable(user)
+        self.context_variable_name = template.Variable(context_variable_name)
+
+    def render(self, context):
+        user = self.user and self.user.resolve(context) or None
+        if user is not None and user.is_anonymous():
+            data = []
+        else:
+            limit = int(self.limit.resolve(context))
+            data = recent.get_recent_comments(limit, user=user)
+        context[self.context_variable_name.resolve(context)] = data
+        return ''
+
 # Register tags
 
 @register.tag('comment_form')
@@ -110,6 +125,26 @@ def do_comment_configuration(parser, token):
     bits = split_tokens(token)
     return ConfigurationNode(bits[2], bits[3], bits[5])
 
+@register.tag('recent_comments')
+def do_recent_comments(parser, token):
+    """Insert the latest comments across all configurations into context,
+    optionally limited to comments posted by a user. Every comment has a
+    ``configuration_key`` attribute.
+
+    Example::
+        {% recent_comments 10 as 'comments' %}
+        {% recent_comments 10 for user as 'comments' %}
+
+    """
+    bits = token.contents.split()
+    if len(bits) == 4 and bits[2] == 'as':
+        return RecentCommentsNode(bits[1], None, bits[3])
+    if len(bits) == 6 and bits[2] == 'for' and bits[4] == 'as':
+        return RecentCommentsNode(bits[1], bits[3], bits[5])
+    raise template.TemplateSyntaxError("'%s' tag takes the form "
+                                       "'%s limit [for user] as name'" % \
+                                       (bits[0], bits[0]))
+
 def split_tokens(token):
     bits = token.contents.split()
     if len(bits) != 6:
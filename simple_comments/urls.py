@@ -10,15 +10,24 @@ p = (
     (r'^(?P<configuration_key>[\w-]+)/(?P<target_id>\d+)/deleted/$',
      'simple_comments.views.comment_deleted', {},
      'simple_comments_comment_deleted'),
+    (r'^(?P<configuration_key>[\w-]+)/moderate/$',
+     'simple_comments.views.moderation_queue', {},
+     'simple_comments_moderation_queue'),
     (r'^(?P<configuration_key>[\w-]+)/$',
      'simple_comments.views.comment_list', {},
      'simple_comments_comment_list'),
     (r'^(?P<configuration_key>[\w-]+)/(?P<target_id>\d+)/$',
      'simple_comments.views.comment_list', {},
      'simple_comments_comment_list_for_target'),
+    (r'^(?P<configuration_key>[\w-]+)/(?P<target_id>\d+)/stream/$',
+     'simple_comments.views.comment_stream', {},
+     'simple_comments_comment_stream'),
     (r'^(?P<configuration_key>[\w-]+)/(?P<target_id>\d+)/(?P<comment_id>\d+)/posted/$',
      'simple_comments.views.comment_posted', {},
      'simple_comments_comment_posted'),
+    (r'^(?P<configuration_key>[\w-]+)/(?P<target_id>\d+)/pending/$',
+     'simple_comments.views.comment_pending', {},
+     'simple_comments_comment_pending'),
 )
 
 urlpatterns = patterns('', *p)
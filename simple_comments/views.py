@@ -18,6 +18,9 @@ def comment_posted(request, configuration_key, target_id, comment_id,
     return config.comment_posted(request, target_id, comment_id,
                                   extra_context)
 
+def comment_pending(request, configuration_key, target_id, extra_context=None):
+    config = get_configuration_or_404(configuration_key)
+    return config.comment_pending(request, target_id, extra_context)
 
 def delete_comment(request, configuration_key, target_id, comment_id):
     config = get_configuration_or_404(configuration_key)
@@ -26,10 +29,17 @@ def delete_comment(request, configuration_key, target_id, comment_id):
 def comment_deleted(request, configuration_key, target_id,
                     extra_context=None):
     config = get_configuration_or_404(configuration_key)
-    return config.comment_deleted(request, target_id, comment_id,
-                                  extra_context)
+    return config.comment_deleted(request, target_id, extra_context)
 
 def comment_list(request, configuration_key, target_id=None,
                  extra_context=None):
     config = get_configuration_or_404(configuration_key)
     return config.comment_list(request, target_id, extra_context)
+
+def comment_stream(request, configuration_key, target_id, extra_context=None):
+    config = get_configuration_or_404(configuration_key)
+    return config.comment_stream(request, target_id, extra_context)
+
+def moderation_queue(request, configuration_key, extra_context=None):
+    config = get_configuration_or_404(configuration_key)
+    return config.moderation_queue(request, extra_context)